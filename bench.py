@@ -0,0 +1,238 @@
+"""
+Benchmarks for the Chinese Vocabulary Utility CLI
+
+Generates synthetic Pleco-shaped and truth-shaped decks of the requested
+sizes in a scratch directory and times the main pipelines against them:
+
+  add        load_ic_lessons + dump_json (what `add` does before its prompt),
+             cold (index build) and warm
+  load       CardStore.load of truth.json (plain json.load for comparison)
+  merge      merge_batch of a half-conflicting input file (concat policy)
+  export     truth_to_card to Fresh Cards text
+  pinyin     convert_pinyin_batch of numbered pinyin to tone marks
+  load-xml   parse_vocab_table of an HTML table
+
+Results (seconds, cards per second and peak traced memory per stage) are
+printed as JSON, so runs can be diffed against each other:
+
+    python bench.py --sizes 1000,100000 -o bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import main
+
+SYLLABLES = sorted(main.PINYIN_SYLLABLES)
+WORDS = [
+    "to",
+    "be",
+    "have",
+    "go",
+    "eat",
+    "drink",
+    "book",
+    "teacher",
+    "student",
+    "friend",
+    "good",
+    "big",
+    "small",
+]
+POS = list(main.matches)
+
+
+def _chinese(i):
+    """A unique 1-3 character headword for index i."""
+    chars = []
+    while True:
+        chars.append(chr(0x4E00 + i % 20000))
+        i //= 20000
+        if not i:
+            return "".join(chars)
+
+
+def make_truth(n, rng):
+    truth = {}
+    for i in range(n):
+        syllables = rng.choices(SYLLABLES, k=rng.randint(1, 3))
+        numbered = "".join(f"{s}{rng.randint(1, 5)}" for s in syllables)
+        truth[_chinese(i)] = {
+            "english": f"{main.matches[rng.choice(POS)]}: "
+            + " ".join(rng.choices(WORDS, k=rng.randint(1, 4))),
+            "pinyin": main.numbered_to_marked(numbered),
+            "chinese": _chinese(i),
+            "level": rng.randint(1, 20),
+        }
+    return truth
+
+
+def make_pleco(truth):
+    cards = [
+        {
+            "+@language": "chinese",
+            "entry": {
+                "headword": card["chinese"],
+                "pron": {"+content": card["pinyin"], "+@type": "hypy"},
+                "defn": card["english"],
+            },
+            "catassign": {"+@category": f"IC3 lesson {card['level']}"},
+        }
+        for card in sorted(truth.values(), key=lambda card: card["level"])
+    ]
+    return {"plecoflash": {"cards": {"card": cards}}}
+
+
+def make_incoming(truth, rng):
+    """Half new cards, half conflicting versions of existing ones."""
+    keys = list(truth)
+    incoming = []
+    for i in range(len(keys) // 2):
+        if i % 2:
+            card = dict(truth[rng.choice(keys)])
+            card["english"] += "; variant"
+            card["level"] = rng.randint(1, 20)
+        else:
+            card = dict(truth[keys[i]], chinese=_chinese(len(keys) + i))
+        incoming.append(card)
+    return incoming
+
+
+def make_html(truth):
+    rows = "".join(
+        f"<tr><td>{card['chinese']}</td><td>{card['pinyin']}</td>"
+        f"<td>{card['english']}</td></tr>"
+        for card in truth.values()
+    )
+    return f"<html><body><table>{rows}</table></body></html>"
+
+
+def measure(results, stage, size, trace, func, *args, **kwargs):
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results.append(
+        {
+            "stage": stage,
+            "size": size,
+            "seconds": round(seconds, 6),
+            "cards_per_second": round(size / seconds) if seconds else None,
+            "peak_bytes": peak,
+        }
+    )
+    print(f"{stage:>12} {size:>9} {seconds:10.3f}s", file=sys.stderr)
+
+
+def _write(file, text):
+    with open(file, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _write_json(file, obj):
+    _write(file, json.dumps(obj, ensure_ascii=False))
+
+
+def _load_json(file):
+    with open(file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run(sizes, trace=True, seed=0):
+    results = []
+    cwd = os.getcwd()
+    for size in sizes:
+        rng = random.Random(seed)
+        with tempfile.TemporaryDirectory() as scratch:
+            os.chdir(scratch)
+            try:
+                truth = make_truth(size, rng)
+                _write_json("ic_truth.json", make_pleco(truth))
+                _write_json("truth.json", truth)
+                incoming = make_incoming(truth, rng)
+                _write_json("incoming.json", incoming)
+                _write("table.html", make_html(truth))
+                numbered = [
+                    main.marked_to_numbered(card["pinyin"]) for card in truth.values()
+                ]
+                del truth, incoming
+
+                def add(lessons):
+                    main.dump_json(main.load_ic_lessons(lessons), "cards.json")
+
+                measure(results, "add-cold", size, trace, add, [3, 4])
+                measure(results, "add-warm", size, trace, add, [3, 4])
+                measure(results, "load-dict", size, trace, _load_json, "truth.json")
+                measure(results, "load", size, trace, main.CardStore.load, "truth.json")
+                measure(
+                    results,
+                    "merge",
+                    size,
+                    trace,
+                    main.merge_batch,
+                    ["incoming.json"],
+                    "concat",
+                    output="merged.json",
+                )
+                measure(results, "export", size, trace, main.truth_to_card, "out.txt")
+                main._segment_pinyin.cache_clear()
+                measure(
+                    results, "pinyin", size, trace, main.convert_pinyin_batch, numbered
+                )
+                measure(
+                    results,
+                    "load-xml",
+                    size,
+                    trace,
+                    main.parse_vocab_table,
+                    "table.html",
+                    1,
+                )
+            finally:
+                os.chdir(cwd)
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Benchmark the vocabulary CLI.")
+    parser.add_argument(
+        "--sizes",
+        default="1000,100000,1000000",
+        help="Comma-separated deck sizes (default: 1000,100000,1000000)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip tracemalloc (faster, but no peak memory figures)",
+    )
+    parser.add_argument("-o", "--output", default=None, help="Write JSON here")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": run(sizes, not args.no_memory, args.seed),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        _write(args.output, text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    cli()
@@ -12,13 +12,60 @@ vocabulary from an HTML table.
 Functions:
   add(lessons, file): Adds vocabulary from the given lessons of Integrated
                       Chinese Level 1 Part 1 to the given vocabulary file.
+  build_ic_index(src, index_dir): Compiles ic_truth.json into a cached,
+                      lesson-partitioned index used by add.
+  add_xml(filein, lessons, file): Streams cards straight from a Pleco XML
+                      flashcard export into the given vocabulary file.
+  dump_json(obj, file): Atomically writes JSON laid out exactly like
+                      `prettier --write` would format it.
+  CardStore: Compact columnar deck (packed strings, level/POS arrays) with
+                      the same mapping API as the truth.json dict.
   merge(file): Merges the given vocabulary file into the ground truth file.
+  merge_batch(files, policy): Merges any number of vocabulary files into the
+                      ground truth file unattended, resolving conflicts by policy.
+  find_duplicates(cards): Clusters near-duplicate cards (traditional vs
+                      simplified, pinyin spacing, prefixes) with MinHash/LSH.
+  consolidate(paths, policy): Merges a whole directory of vocabulary files
+                      in one parallel k-way pass and writes truth.json once.
+  open_store(db): Opens (creating if needed) the SQLite ground truth store,
+                      an optional alternative to truth.json.
+  store_import(file, db) / store_export(db, file): Copy the ground truth
+                      between truth.json and the SQLite store.
+  write_snapshot(src, file) / Snapshot(file): Compile the deck into a binary
+                      snapshot that processes mmap and binary-search in place;
+                      truth_to_card filters read it while it is current.
+  numbered_to_marked(pinyin) / marked_to_numbered(pinyin): Table-driven
+                      pinyin conversion, including unspaced syllables.
+  convert_pinyin_batch(items, mode): Converts whole lists of pinyin at once.
+  normalize(paths): Expands grammar type abbreviations across whole files
+                      in parallel, reporting the cards it cannot classify.
+  lint(paths): Checks cards for invalid pinyin, syllable/character count
+                      mismatches, tone problems and empty fields.
   review(file): Allows review and modification of the vocabulary definitions.
   custom(file, lesson=None): Allows the user to add custom vocabulary entries.
-  truth_to_card(file, accept=lambda card: True): Exports the ground truth file to
+                      Both keep an edit journal, so interrupted sessions resume.
+  truth_to_card(file, accept=None): Exports the ground truth file to
                       a text file for use with Anki/other apps.
-  load_xml(filein, fileout, level): Loads vocabulary from an HTML table in a
-                      specific format into the given vocabulary file.
+  CardFilter(expression): Compiles export filters such as 'level<=5 and
+                      pos:verb', answered from level/POS indexes.
+  export_cards(cards, file, fmt): Streams cards out as Fresh Cards text,
+                      Anki TSV/CSV, Pleco XML or an Anki .apkg package.
+  export_delta(file, ...): Exports only what changed since the last export,
+                      tracked by per-card content hashes.
+  search(query): Looks cards up in truth.json and user/ through a persistent
+                      inverted index that is refreshed when the files change.
+  coverage(paths): Measures how much of a text corpus the vocabulary covers,
+                      by level, with the most frequent unknown segments.
+  study(file, learner): Spaced-repetition (SM-2) study session over the
+                      cards that are due, with an append-only review log.
+  serve(file): Daemon that keeps the deck in memory and answers lookup, add,
+                      export and pinyin requests over a local socket.
+  load_xml(filein, fileout, level): Loads vocabulary from HTML tables in a
+                      specific format into the given vocabulary file, parsing
+                      several files in parallel.
+
+Every command accepts --metrics FILE (per-stage timings as JSON lines) and
+--profile FILE (a cProfile dump), given before the command name.
 
 To get help on how to use a command:
     python dev/main.py -h
@@ -28,10 +75,41 @@ To get help on how to use a command:
 """
 
 import argparse
+import array
+import asyncio
+import bisect
+import collections.abc
+import contextlib
+import cProfile
+import csv
+import functools
+import glob
+import hashlib
+import heapq
+import html
+import itertools
 import json
+import math
+import mmap
 import os
 import re
-import subprocess
+import signal
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import unicodedata
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 matches = {
     "adj": "adjective",
@@ -55,6 +133,829 @@ matches = {
     "vo": "verb + object",
 }
 
+IC_INDEX_DIR = ".ic_index"
+TRUTH_DB = "truth.db"
+SNAPSHOT = "truth.snap"
+PRINT_WIDTH = 80  # prettier's default printWidth
+
+
+_metrics = None  # list of stage records while --metrics/--profile is active
+_command = None
+
+
+def _rusage():
+    """(peak RSS in bytes, CPU seconds of reaped child processes)."""
+    if resource is None:
+        return None, 0.0
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is KiB on Linux
+    return own.ru_maxrss * scale, children.ru_utime + children.ru_stime
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time one pipeline stage when metrics are enabled (a no-op otherwise).
+    Yields a dict the stage can put counts into, e.g. info["cards"] = n.
+    Records wall time, CPU time, peak RSS and the CPU time of subprocesses.
+    """
+    info = {}
+    if _metrics is None:
+        yield info
+        return
+    _, child_before = _rusage()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield info
+    finally:
+        peak_rss, child_after = _rusage()
+        _metrics.append(
+            {
+                "command": _command,
+                "stage": name,
+                "wall": round(time.perf_counter() - wall, 6),
+                "cpu": round(time.process_time() - cpu, 6),
+                "subprocess_cpu": round(child_after - child_before, 6),
+                "peak_rss": peak_rss,
+                **info,
+            }
+        )
+
+
+def _text_width(text):
+    """Display width of a string as prettier measures it (CJK counts double)."""
+    if text.isascii():
+        return len(text)
+    width = 0
+    for char in text:
+        code = ord(char)
+        if code <= 0x1F or 0x7F <= code <= 0x9F or 0x300 <= code <= 0x36F:
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in "WF" else 1
+    return width
+
+
+def _json_scalar(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _json_breaks(value):
+    """
+    Whether prettier always expands this value: an array of two or more
+    objects (or arrays) that each have several entries, or anything
+    containing one.
+    """
+    if isinstance(value, dict):
+        return any(_json_breaks(v) for v in value.values())
+    if isinstance(value, list):
+        if len(value) > 1 and (
+            all(isinstance(v, dict) and len(v) > 1 for v in value)
+            or all(isinstance(v, list) and len(v) > 1 for v in value)
+        ):
+            return True
+        return any(_json_breaks(v) for v in value)
+    return False
+
+
+def _json_flat_width(value, budget):
+    """Width of the one-line form of value, or -1 once it exceeds budget."""
+    if isinstance(value, dict):
+        if not value:
+            return 2
+        width = 4 * len(value) + 2  # "{ ", " }", and ": " / ", " per entry
+        for key, item in value.items():
+            width += _text_width(_json_scalar(key))
+            if width > budget:
+                return -1
+            inner = _json_flat_width(item, budget - width)
+            if inner < 0:
+                return -1
+            width += inner
+    elif isinstance(value, list):
+        width = 2 + max(0, 2 * (len(value) - 1))
+        for item in value:
+            if width > budget:
+                return -1
+            inner = _json_flat_width(item, budget - width)
+            if inner < 0:
+                return -1
+            width += inner
+    else:
+        width = _text_width(_json_scalar(value))
+    return width if width <= budget else -1
+
+
+def _json_flat(value):
+    if isinstance(value, dict):
+        if not value:
+            return "{}"
+        items = (f"{_json_scalar(k)}: {_json_flat(v)}" for k, v in value.items())
+        return "{ " + ", ".join(items) + " }"
+    if isinstance(value, list):
+        return "[" + ", ".join(map(_json_flat, value)) + "]"
+    return _json_scalar(value)
+
+
+def _json_chunks(value, depth=0, used=0, trailing=0):
+    """
+    Yield the prettier layout of value piece by piece. A container stays on
+    one line if it fits in the remaining print width (counting a trailing
+    comma), otherwise it is expanded with one entry per line.
+
+    Args:
+      depth: Indentation level of the line value starts on.
+      used: Width already taken on that line (indent and key).
+      trailing: Width of what follows value on the same line (0 or 1).
+    """
+    if not isinstance(value, (dict, list)) or not value:
+        yield _json_flat(value)
+        return
+    if (
+        not _json_breaks(value)
+        and _json_flat_width(value, PRINT_WIDTH - used - trailing) >= 0
+    ):
+        yield _json_flat(value)
+        return
+    pad = "  " * (depth + 1)
+    if isinstance(value, dict):
+        yield "{\n"
+        last = len(value) - 1
+        for i, (key, item) in enumerate(value.items()):
+            prefix = f"{pad}{_json_scalar(key)}: "
+            yield prefix
+            yield from _json_chunks(
+                item, depth + 1, _text_width(prefix), 0 if i == last else 1
+            )
+            yield "\n" if i == last else ",\n"
+        yield "  " * depth + "}"
+    else:
+        yield "[\n"
+        last = len(value) - 1
+        for i, item in enumerate(value):
+            yield pad
+            yield from _json_chunks(item, depth + 1, len(pad), 0 if i == last else 1)
+            yield "\n" if i == last else ",\n"
+        yield "  " * depth + "]"
+
+
+_UMASK = os.umask(0)  # read once: os.umask can only be read by setting it
+os.umask(_UMASK)
+
+
+@contextlib.contextmanager
+def _atomic_open(file, mode="w", newline=None):
+    """
+    Open a temporary file next to file for writing; on success it is synced
+    and os.replace'd over file (with the permissions a plain open would
+    give it), on error it is removed.
+    """
+    # closed below on both paths; a with block would close it before the
+    # caller is done writing
+    tmp = tempfile.NamedTemporaryFile(  # noqa: SIM115
+        mode,
+        buffering=1 << 16,
+        encoding=None if "b" in mode else "utf-8",
+        newline=newline,
+        dir=os.path.dirname(os.path.abspath(file)),
+        prefix=f".{os.path.basename(file)}.",
+        suffix=".tmp",
+        delete=False,
+    )
+    try:
+        yield tmp
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp.close()
+        os.chmod(tmp.name, 0o666 & ~_UMASK)
+        os.replace(tmp.name, file)
+    except BaseException:
+        tmp.close()
+        os.remove(tmp.name)
+        raise
+
+
+def dump_json(obj, file):
+    """
+    Write obj to file as JSON in the same layout `npx prettier --write`
+    produces for a one-line json.dump, without starting Node. The file is
+    written to a temporary sibling and atomically renamed into place, so
+    readers never see a half-written file.
+
+    Args:
+      obj: JSON-serializable value (usually a list of cards or truth dict)
+           or a CardStore.
+      file: Output JSON file.
+    """
+    if isinstance(obj, CardStore):
+        obj.dump(file)
+        return
+    with _atomic_open(file) as f:
+        f.writelines(_json_chunks(obj))
+        f.write("\n")
+
+
+def dump_json_stream(cards, file):
+    """
+    Like dump_json for a list of cards, but consumes an iterable so the list
+    never has to exist in memory. Two or more cards always expand one per
+    line (as prettier does for arrays of objects), so each card can be laid
+    out as soon as it arrives.
+
+    Returns:
+      Number of cards written.
+    """
+    cards = iter(cards)
+    head = list(itertools.islice(cards, 2))
+    if len(head) < 2:
+        dump_json(head, file)
+        return len(head)
+    count = 0
+    with _atomic_open(file) as f:
+        f.write("[\n")
+        pending = head[0]
+        # hold one card back: only the last one has no trailing comma
+        for card in itertools.chain(head[1:], cards):
+            f.write("  ")
+            f.writelines(_json_chunks(pending, 1, 2, 1))
+            f.write(",\n")
+            pending = card
+            count += 1
+        f.write("  ")
+        f.writelines(_json_chunks(pending, 1, 2, 0))
+        f.write("\n]\n")
+    return count + 1
+
+
+def append_jsonl(file, entry):
+    """Append one JSON line to an append-only log and make sure it reached
+    the disk."""
+    with open(file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_jsonl(file, offset=0):
+    """
+    Read an append-only JSON-lines log from a byte offset. A last line torn
+    by a crash mid-write (no newline) is cut off the file, so appending can
+    carry on; complete lines that are not valid JSON are skipped.
+
+    Returns:
+      A (entries, end) tuple: the decoded entries and the offset just past
+      the last complete line. A missing file has no entries.
+    """
+    entries = []
+    if not os.path.exists(file):
+        return entries, 0
+    with open(file, "rb+") as f:
+        f.seek(offset)
+        end = offset
+        for line in f:
+            if not line.endswith(b"\n"):
+                f.truncate(end)
+                break
+            end += len(line)
+            if line.strip():
+                with contextlib.suppress(ValueError):
+                    entries.append(json.loads(line))
+    return entries, end
+
+
+CARD_TEXT_FIELDS = ("english", "pinyin", "chinese")
+_NO_LEVEL = -(1 << 31)
+
+
+class _StringColumn:
+    """
+    Strings packed as UTF-8 into one bytearray, addressed by offset and
+    length arrays: about 12 bytes of overhead per string instead of a str
+    object each. Overwriting a value appends it; dead bytes are dropped
+    when the owning CardStore is compacted.
+    """
+
+    __slots__ = ("data", "lengths", "starts")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.starts = array.array("Q")
+        self.lengths = array.array("I")
+
+    def append(self, text):
+        encoded = text.encode("utf-8")
+        self.starts.append(len(self.data))
+        self.lengths.append(len(encoded))
+        self.data += encoded
+
+    def __getitem__(self, row):
+        start = self.starts[row]
+        return self.data[start : start + self.lengths[row]].decode("utf-8")
+
+    def __setitem__(self, row, text):
+        encoded = text.encode("utf-8")
+        self.starts[row] = len(self.data)
+        self.lengths[row] = len(encoded)
+        self.data += encoded
+
+
+class Card(collections.abc.MutableMapping):
+    """
+    A card of a CardStore. It reads and writes through to the store's
+    columns and otherwise behaves like the card's dict (card["english"],
+    card.get("level"), dict(card), comparison with dicts, ...).
+    """
+
+    __slots__ = ("_row", "_store")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, field):
+        return self._store._get_field(self._row, field)
+
+    def __setitem__(self, field, value):
+        self._store._set_field(self._row, field, value)
+
+    def __delitem__(self, field):
+        store, row = self._store, self._row
+        card = store._card_dict(row)
+        del card[field]
+        store._write_row(row, card)
+
+    def __iter__(self):
+        return iter(self._store._layouts[self._store._layout[self._row]])
+
+    def __len__(self):
+        return len(self._store._layouts[self._store._layout[self._row]])
+
+    def __repr__(self):
+        return f"Card({self._store._card_dict(self._row)!r})"
+
+    def to_dict(self):
+        """A plain dict copy of the card, as it appears in the JSON files."""
+        return self._store._card_dict(self._row)
+
+    @property
+    def pos(self):
+        """Interned part of speech of the card (see _card_pos)."""
+        return self._store._pos_names[self._store._pos[self._row]]
+
+
+class CardStore(collections.abc.MutableMapping):
+    """
+    Compact in-memory deck. Instead of a dict (and its strings) per card,
+    cards are rows of columns: english, pinyin and chinese packed as UTF-8
+    (_StringColumn), levels in an int array, and interned part-of-speech
+    and key-order codes in small arrays. Anything else (unknown fields,
+    non-integer levels) is kept per row in a sparse dict, so any card
+    round-trips to exactly the same JSON.
+
+    The store is a mapping keyed by chinese like truth.json (store[key],
+    store[key] = card, key in store, items(), ...), and its cards can also
+    be read by position (store.card(i)) like the list-shaped vocabulary
+    files. Cards come back as Card views that write through to the store.
+    dump_json writes a store in the layout of the file it came from.
+
+    Deleting a card only marks its row dead; rows keep their numbers (and
+    the columns their bytes) until compact() drops the dead ones.
+    """
+
+    def __init__(self, keyed=True):
+        self.keyed = keyed
+        self._text = {field: _StringColumn() for field in CARD_TEXT_FIELDS}
+        self._level = array.array("i")
+        self._pos = array.array("H")
+        self._pos_names = [""]
+        self._pos_codes = {"": 0}
+        self._pos_heads = {}  # text before ':' -> pos code, see _card_pos
+        self._layout = array.array("H")
+        self._layouts = []
+        self._layout_codes = {}
+        self._extra = {}  # row -> {field: value} for what the columns can't hold
+        self._keys = {}  # row -> truth key, where it differs from chinese
+        self._dead = set()  # rows of deleted cards, see compact
+        self._index = None  # key -> row, built on first keyed access
+        self._filter_index = None  # level and POS indexes for rows()
+
+    # -- loading and saving
+
+    @classmethod
+    def from_json(cls, data):
+        """Build a store from a truth.json-style dict or a list of cards."""
+        store = cls(keyed=isinstance(data, dict))
+        if store.keyed:
+            for key, card in data.items():
+                store[key] = card
+        else:
+            store.extend(data)
+        return store
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a vocabulary JSON file (truth.json-style dict or list of cards).
+        Cards go into the columns as the parser produces them, so the file
+        never exists as one dict per card.
+        """
+        store = cls()
+
+        def hook(obj):
+            if isinstance(obj.get("chinese"), str):
+                return _LoadedRow(store._append(obj))
+            return obj
+
+        with open(file, encoding="utf-8") as f:
+            data = json.load(f, object_hook=hook)
+        if isinstance(data, dict):
+            for key, loaded in data.items():
+                if key != store._chinese(loaded.row):
+                    store._keys[loaded.row] = key
+        else:
+            store.keyed = False
+        return store
+
+    def to_json(self):
+        """The deck as the plain dict (or list) json.load would return."""
+        if self.keyed:
+            return {self._key(row): self._card_dict(row) for row in self._rows()}
+        return [self._card_dict(row) for row in self._rows()]
+
+    def dump(self, file):
+        """Write the deck like dump_json(self.to_json(), file), card by card."""
+        if not self.keyed:
+            dump_json_stream(map(self._card_dict, self._rows()), file)
+            return
+        if len(self) < 8:  # a handful of tiny cards may fit on one line
+            dump_json(self.to_json(), file)
+            return
+        with _atomic_open(file) as f:
+            f.write("{\n")
+            last = len(self) - 1
+            for i, row in enumerate(self._rows()):
+                prefix = f"  {_json_scalar(self._key(row))}: "
+                f.write(prefix)
+                f.writelines(
+                    _json_chunks(
+                        self._card_dict(row),
+                        1,
+                        _text_width(prefix),
+                        0 if i == last else 1,
+                    )
+                )
+                f.write("\n" if i == last else ",\n")
+            f.write("}\n")
+
+    # -- mapping and sequence API
+
+    def __getitem__(self, key):
+        return Card(self, self._lookup()[key])
+
+    def __setitem__(self, key, card):
+        index = self._lookup()
+        if key in index:
+            self._write_row(index[key], card)
+            return
+        row = self._append(card)
+        if key != self._chinese(row):
+            self._keys[row] = key
+        index[key] = row
+
+    def __delitem__(self, key):
+        index = self._lookup()
+        row = index.pop(key)
+        self._dead.add(row)
+        self._filter_index = None
+        self._extra.pop(row, None)
+        self._keys.pop(row, None)
+        if not self.keyed:
+            self._index = None  # a later card may have the same chinese
+
+    def __iter__(self):
+        return map(self._key, self._rows())
+
+    def __len__(self):
+        return len(self._layout) - len(self._dead)
+
+    def __contains__(self, key):
+        return key in self._lookup()
+
+    def values(self):
+        return (Card(self, row) for row in self._rows())
+
+    def items(self):
+        return ((self._key(row), Card(self, row)) for row in self._rows())
+
+    def card(self, i):
+        """The card in row i (its position in file order, see compact)."""
+        rows = len(self._layout)
+        if not -rows <= i < rows or i % rows in self._dead:
+            raise IndexError(i)
+        return Card(self, i % rows)
+
+    def append(self, card):
+        row = self._append(card)
+        if self._index is not None:
+            self._index.setdefault(self._key(row), row)
+
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def rows(self, min_level=None, max_level=None, pos=None):
+        """
+        Rows (positions in file order, see compact) of the cards with a level in
+        [min_level, max_level] whose grammar types include pos, like
+        store_cards. They are answered from a level-sorted row index and
+        the interned part-of-speech codes, built on first use, rather than
+        by looking at every card.
+        """
+        if self._filter_index is None:
+            by_level = sorted(
+                (level, row)
+                for row in self._rows()
+                if (level := self._usable_level(row)) is not None
+            )
+            by_pos = collections.defaultdict(lambda: array.array("I"))
+            for row in self._rows():
+                by_pos[self._pos[row]].append(row)
+            self._filter_index = (
+                array.array("q", (level for level, _ in by_level)),
+                array.array("I", (row for _, row in by_level)),
+                by_pos,
+            )
+        levels, level_rows, by_pos = self._filter_index
+        codes = None
+        if pos is not None:
+            codes = {
+                code
+                for code, name in enumerate(self._pos_names)
+                if pos in name.split(", ")
+            }
+        if min_level is None and max_level is None:
+            if codes is None:
+                return list(self._rows())
+            return sorted(row for code in codes for row in by_pos.get(code, ()))
+        lo, hi = 0, len(levels)
+        if min_level is not None:
+            lo = bisect.bisect_left(levels, min_level)
+        if max_level is not None:
+            hi = bisect.bisect_right(levels, max_level)
+        rows = level_rows[lo:hi]
+        if codes is not None:
+            rows = [row for row in rows if self._pos[row] in codes]
+        return sorted(rows)
+
+    def compact(self):
+        """
+        Drop the rows of deleted cards and the bytes of overwritten text.
+        The remaining cards are renumbered, so rows() and card() positions
+        are file positions again.
+        """
+        live = [(self._key(row), self._card_dict(row)) for row in self._rows()]
+        keyed = self.keyed
+        self.__init__(keyed)
+        for key, card in live:
+            if keyed:
+                self[key] = card
+            else:
+                self.append(card)
+
+    # -- internals
+
+    def _rows(self):
+        if not self._dead:
+            return range(len(self._layout))
+        return (row for row in range(len(self._layout)) if row not in self._dead)
+
+    def _chinese(self, row):
+        return self._get_field(row, "chinese")
+
+    def _key(self, row):
+        return self._keys[row] if row in self._keys else self._chinese(row)
+
+    def _lookup(self):
+        if self._index is None:
+            self._index = {}
+            for row in self._rows():
+                self._index.setdefault(self._key(row), row)
+        return self._index
+
+    def _intern(self, names, codes, value):
+        if value not in codes:
+            codes[value] = len(names)
+            names.append(value)
+        return codes[value]
+
+    def _append(self, card):
+        self._filter_index = None
+        row = len(self._layout)
+        fields = tuple(card)
+        self._layout.append(self._intern(self._layouts, self._layout_codes, fields))
+        extra = {}
+        for field, column in self._text.items():
+            value = card.get(field, "")
+            if isinstance(value, str):
+                column.append(value)
+            else:
+                column.append("")
+                extra[field] = value
+        level = card.get("level", _NO_LEVEL)
+        if type(level) is int and _NO_LEVEL < level < 1 << 31:
+            self._level.append(level)
+        else:
+            self._level.append(_NO_LEVEL)
+            if "level" in card:
+                extra["level"] = level
+        for field in fields:
+            if field not in self._text and field != "level":
+                extra[field] = card[field]
+        if extra:
+            self._extra[row] = extra
+        self._pos.append(0)
+        self._update_pos(row)
+        return row
+
+    def _write_row(self, row, card):
+        self._filter_index = None
+        self._extra.pop(row, None)
+        fields = tuple(card)
+        self._layout[row] = self._intern(self._layouts, self._layout_codes, fields)
+        for field in CARD_TEXT_FIELDS:
+            self._text[field][row] = ""
+        self._level[row] = _NO_LEVEL
+        for field in fields:
+            self._store_field(row, field, card[field])
+        self._update_pos(row)
+
+    def _store_field(self, row, field, value):
+        extra = self._extra.get(row)
+        if extra is not None:
+            extra.pop(field, None)
+        if field in self._text and isinstance(value, str):
+            self._text[field][row] = value
+        elif field == "level" and type(value) is int and _NO_LEVEL < value < 1 << 31:
+            self._level[row] = value
+        else:
+            self._extra.setdefault(row, {})[field] = value
+
+    def _update_pos(self, row):
+        english = self._text["english"][row]
+        head = english.partition(":")[0] if ":" in english else ""
+        if head not in self._pos_heads:
+            pos = _card_pos(english)
+            self._pos_heads[head] = self._intern(self._pos_names, self._pos_codes, pos)
+        self._pos[row] = self._pos_heads[head]
+
+    def _get_field(self, row, field):
+        extra = self._extra.get(row)
+        if extra is not None and field in extra:
+            return extra[field]
+        if field not in self._layouts[self._layout[row]]:
+            raise KeyError(field)
+        if field == "level":
+            return self._level[row]
+        return self._text[field][row]
+
+    def _set_field(self, row, field, value):
+        self._filter_index = None
+        if field == "chinese" and row not in self._keys:
+            if self.keyed:
+                # truth keys stay put when a card's characters change
+                self._keys[row] = self._chinese(row)
+            else:
+                self._index = None
+        fields = self._layouts[self._layout[row]]
+        if field not in fields:
+            fields = (*fields, field)
+            self._layout[row] = self._intern(self._layouts, self._layout_codes, fields)
+        self._store_field(row, field, value)
+        if field == "english":
+            self._update_pos(row)
+
+    def _usable_level(self, row):
+        level = self._level[row]
+        if level == _NO_LEVEL:
+            level = _card_level(self._extra.get(row, {}))
+            return None if level == math.inf else level
+        return level if level >= 0 else None  # as _card_level reads it
+
+    def _card_dict(self, row):
+        return {
+            field: self._get_field(row, field)
+            for field in self._layouts[self._layout[row]]
+        }
+
+
+class _LoadedRow:
+    """Placeholder CardStore.load leaves in the parsed JSON for a card."""
+
+    __slots__ = ("row",)
+
+    def __init__(self, row):
+        self.row = row
+
+
+def _ic_card(card):
+    """
+    Convert one card of the Pleco XML-to-JSON dump into a vocabulary card.
+
+    Returns:
+      A (lesson, card) tuple, where lesson is the lesson number (int).
+    """
+    phrase = card["entry"]["headword"]
+    if len(phrase[0]) != 1:
+        phrase = list(filter(lambda a: a["+@charset"] == "sc", phrase))[0]["+content"]
+    level = int(card["catassign"]["+@category"].split()[-1])
+    return level, {
+        "english": card["entry"]["defn"],
+        "pinyin": card["entry"]["pron"]["+content"],
+        "chinese": phrase,
+        "level": level,
+    }
+
+
+def build_ic_index(src="ic_truth.json", index_dir=IC_INDEX_DIR):
+    """
+    Compile the Pleco dump into a lesson-partitioned index: one small JSON
+    file per lesson plus a manifest. The index is rebuilt only when the
+    source changes (mtime/size first, then SHA-256 so a plain touch does not
+    force a reparse).
+
+    Args:
+      src: Pleco XML-to-JSON dump (ic_truth.json).
+      index_dir: Directory holding the compiled index.
+
+    Returns:
+      The index manifest (dict).
+    """
+    stat = os.stat(src)
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["mtime"] == stat.st_mtime_ns and manifest["size"] == stat.st_size:
+            return manifest
+    with open(src, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if manifest is not None and manifest["sha256"] == digest:
+        manifest["mtime"], manifest["size"] = stat.st_mtime_ns, stat.st_size
+        with _atomic_open(manifest_path) as f:
+            json.dump(manifest, f)
+        return manifest
+
+    lessons = {}
+    with open(src, encoding="utf-8") as f:
+        dump = json.load(f)
+    for entry in dump["plecoflash"]["cards"]["card"]:
+        level, card = _ic_card(entry)
+        lessons.setdefault(level, []).append(card)
+    os.makedirs(index_dir, exist_ok=True)
+    if os.path.exists(manifest_path):
+        # invalidate first so an interrupted rebuild is never trusted
+        os.remove(manifest_path)
+    for name in os.listdir(index_dir):
+        if name.startswith("lesson_"):
+            os.remove(os.path.join(index_dir, name))
+    for level, cards in lessons.items():
+        path = os.path.join(index_dir, f"lesson_{level}.json")
+        with _atomic_open(path) as f:
+            json.dump(cards, f, ensure_ascii=False)
+    manifest = {
+        "source": os.path.abspath(src),
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": digest,
+        "lessons": {str(level): len(cards) for level, cards in lessons.items()},
+    }
+    # the manifest goes last: it is only trusted once every lesson is in place
+    with _atomic_open(manifest_path) as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def load_ic_lessons(lessons, src="ic_truth.json", index_dir=IC_INDEX_DIR):
+    """
+    Load the cards of the given lessons from the compiled index, rebuilding
+    it first if ic_truth.json changed. Only the requested lessons are read.
+
+    Args:
+      lessons: List of lesson numbers (ints) to include.
+
+    Returns:
+      List of cards, in the order the lessons appear in the source.
+    """
+    manifest = build_ic_index(src, index_dir)
+    cards = []
+    for level in manifest["lessons"]:
+        if int(level) in lessons:
+            path = os.path.join(index_dir, f"lesson_{level}.json")
+            with open(path, encoding="utf-8") as f:
+                cards.extend(json.load(f))
+    return cards
+
 
 def add(lessons, file):
     """
@@ -65,59 +966,117 @@ def add(lessons, file):
       lessons: List of lesson numbers (ints) to include.
       file: Output JSON file to save the vocabulary.
     """
-    ic = json.load(open("ic_truth.json"))
-    cards = []
-    for card in ic["plecoflash"]["cards"]["card"]:
-        phrase = card["entry"]["headword"]
-        if len(phrase[0]) != 1:
-            phrase = list(filter(lambda a: a["+@charset"] == "sc", phrase))[0][
-                "+content"
-            ]
-        pinyin = card["entry"]["pron"]["+content"]
-        english = card["entry"]["defn"]
-        level = card["catassign"]["+@category"].split()[-1]
-        if int(level) not in lessons:
-            continue
-        cards.append(
-            {
-                "english": english,
-                "pinyin": pinyin,
-                "chinese": phrase,
-                "level": int(level),
-            }
-        )
-    json.dump(cards, open(file, "w"), ensure_ascii=False)
-    os.system("npx prettier --write " + file)
+    with stage("load") as info:
+        cards = load_ic_lessons(lessons)
+        info["cards"] = len(cards)
+    with stage("write"):
+        dump_json(cards, file)
     rev = input("Review definitions? (y/Y for yes, any other key for no): ")
     if rev.lower() == "y":
         review(file)
 
 
-def merge(file):
+def iter_pleco_xml(filein, lessons=None):
+    """
+    Stream vocabulary cards out of a Pleco XML flashcard export. Cards are
+    parsed one at a time and discarded, so memory stays constant no matter
+    how large the export is.
+
+    Args:
+      filein: Pleco .xml flashcard file.
+      lessons: Optional list of lesson numbers (ints) to keep (default: all).
+
+    Yields:
+      Cards with english, pinyin, chinese and level keys, in file order.
+    """
+    parents = []  # elements enclosing the current one, outermost first
+    for event, elem in ET.iterparse(filein, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag != "card":
+            continue
+        level = None
+        for cat in elem.iter("catassign"):
+            words = cat.get("category", "").split()
+            if words and words[-1].isdigit():
+                level = int(words[-1])
+                break
+        entry = elem.find("entry")
+        headwords = [] if entry is None else entry.findall("headword")
+        if entry is not None and not headwords:
+            print(f"{filein}: skipping a card without a headword", file=sys.stderr)
+        elif (
+            level is not None
+            and entry is not None
+            and (lessons is None or level in lessons)
+        ):
+            phrase = next(
+                (h for h in headwords if h.get("charset") == "sc"), headwords[0]
+            )
+            yield {
+                "english": entry.findtext("defn", "").strip(),
+                "pinyin": entry.findtext("pron", "").strip(),
+                "chinese": (phrase.text or "").strip(),
+                "level": level,
+            }
+        # drop the parsed card and its parent's reference to it
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+
+def add_xml(filein, lessons, file):
+    """
+    Add vocabulary from a Pleco XML flashcard export to the card JSON file,
+    streaming both the input and the output.
+
+    Args:
+      filein: Pleco .xml flashcard file.
+      lessons: List of lesson numbers (ints) to include, or None for all.
+      file: Output JSON file to save the vocabulary.
+
+    Returns:
+      Number of cards written.
+    """
+    with stage("stream") as info:
+        info["cards"] = dump_json_stream(iter_pleco_xml(filein, lessons), file)
+    return info["cards"]
+
+
+def merge(file, near=False):
     """
     Merge a given vocabulary JSON file into the ground truth file (truth.json)
     and invoke an interactive conflict resolution if multiple entries are
-    found for the same Chinese string.
+    found for the same Chinese string. With near, clusters of near-duplicate
+    cards (see find_duplicates) are offered for resolution afterwards.
     """
-    ground = json.load(open("truth.json"))
-    for key in ground.keys():
-        ground[key] = [ground[key]]
-    cards = json.load(open(file))
+    with stage("load") as info:
+        ground = CardStore.load("truth.json")
+        with open(file, encoding="utf-8") as f:
+            cards = json.load(f)
+        info["cards"] = len(ground) + len(cards)
+    # only keys with more than one version need a list of them
+    conflicts = {}
     for card in cards:
         key = card["chinese"]
-        if key not in ground.keys():
-            ground[key] = [card]
+        if key in conflicts:
+            conflicts[key].append(card)
+        elif key in ground:
+            conflicts[key] = [ground[key].to_dict(), card]
         else:
-            ground[key] = [*ground[key], card]
+            ground[key] = card
 
     def resolve_conflict(key):
+        versions = conflicts[key]
         print("============= CONFLICT =============")
-        for i in range(len(ground[key])):
+        for i in range(len(versions)):
             print(f"**** V{i + 1}: ****")
-            print(f"\teng: {ground[key][i]['english']}")
-            print(f"\tpin: {ground[key][i]['pinyin']}")
-            print(f"\tchi: {ground[key][i]['chinese']}")
-            print(f"\tlev: {ground[key][i]['level']}")
+            print(f"\teng: {versions[i]['english']}")
+            print(f"\tpin: {versions[i]['pinyin']}")
+            print(f"\tchi: {versions[i]['chinese']}")
+            print(f"\tlev: {versions[i]['level']}")
             print("\n")
         print("Resolve conflict:")
         print(" * type V1, V2, ... to substitute that version's value")
@@ -130,14 +1089,10 @@ def merge(file):
             value = str(input(f"{v}: ").strip())
             if not value:
                 print("\tUsing version 1")
-                return str(ground[key][0][v])
-            if (
-                len(value) == 2
-                and value[0] == "V"
-                and int(value[1]) <= len(ground[key])
-            ):
+                return str(versions[0][v])
+            if len(value) == 2 and value[0] == "V" and int(value[1]) <= len(versions):
                 print(f"\tUsing version {value}")
-                return str(ground[key][int(value[1:]) - 1][v])
+                return str(versions[int(value[1:]) - 1][v])
             return value
 
         card = {}
@@ -155,7 +1110,7 @@ def merge(file):
                 )
             print(f"Got it. Card V{keep} will not be changed.")
             keep = int(keep)
-            for i in range(1, len(ground[key]) + 1):
+            for i in range(1, len(versions) + 1):
                 if i == keep:
                     continue
                 while True:
@@ -163,7 +1118,7 @@ def merge(file):
                     while newchars in ground:
                         print(f"Character '{newchars}' already in use.")
                         newchars = input(f"New characters for version {i}: ")
-                    newcard = ground[key][i - 1]
+                    newcard = versions[i - 1]
                     newcard["chinese"] = newchars
                     print("Final card:")
                     print(f"\teng: {newcard['english']}")
@@ -176,9 +1131,9 @@ def merge(file):
                     if redo.lower() == "n":
                         continue
                     else:
-                        ground[newchars] = [newcard]
+                        ground[newchars] = newcard
                         break
-            keep = ground[key][keep - 1]
+            keep = versions[keep - 1]
             return keep
         card["english"] = en
         card["pinyin"] = getv("pinyin")
@@ -188,7 +1143,6 @@ def merge(file):
             print("Invalid input. Please enter a number.")
             level = getv("level")
         card["level"] = int(level)
-        ground[key] = [card]
         print("Final card:")
         print(f"\teng: {card['english']}")
         print(f"\tpin: {card['pinyin']}")
@@ -201,124 +1155,1511 @@ def merge(file):
             return resolve_conflict(key)
         return card
 
-    keys_to_handle = list(filter(lambda a: len(ground[a]) > 1, ground.keys()))
-    for key in keys_to_handle:
-        if len(ground[key]) > 1:
-            ground[key] = [resolve_conflict(key)]
-    for key in ground.keys():
-        ground[key] = ground[key][0]
-    json.dump(ground, open("truth.json", "w"), ensure_ascii=False)
-    os.system("npx prettier --write truth.json")
+    with stage("resolve") as info:
+        info["conflicts"] = len(conflicts)
+        for key in conflicts:
+            ground[key] = resolve_conflict(key)
+    if near:
+        with stage("near-duplicates") as info:
+            clusters = duplicate_clusters(ground)
+            info["clusters"] = len(clusters)
+        resolve_duplicates(ground, clusters)
+    with stage("write"):
+        dump_json(ground, "truth.json")
 
 
-def review(file):
-    """
-    Review vocabulary in a given JSON file and interactively adjust
-    English definitions. Also expands grammatical shorthand if possible.
-    """
-    cards = json.load(open(file))
-    i = 0
-    print("Basic rules:")
-    print(
-        "\tCard details will be shown. You will decide whether to keep the same definition or change the definition."
-    )
-    print(
-        "\tA warning will be shown if the card does not have a known grammar type. The reviewer will generally expand grammar types."
-    )
-    print(
-        "\tEscape codes:\n\t\tenter to keep the same definition. UP followed by a number, e.g., 'UP2' to go back that many cards."
-    )
-    print("\t")
-    while i < len(cards):
-        splits = re.split(r"(:|\+)", cards[i]["english"])
-        determine = True
-        if len(splits) < 2 or not all(
-            map(lambda x: x.strip() in matches, splits[0].split(","))
-        ):
-            determine = False
-        else:
-            main = list(map(lambda a: matches[a.strip()], splits[0].split(",")))
-            cards[i]["english"] = f"{', '.join(main)}:{''.join(splits[2:])}"
+MERGE_POLICIES = {
+    "prefer-incoming": "the last incoming version wins",
+    "prefer-truth": "the version already in truth.json (or the first seen) wins",
+    "lowest-level": "the version with the lowest level wins; ties are unresolved",
+    "concat": "definitions are concatenated; the lowest level is kept",
+    "defer": "nothing is resolved; every conflict goes to the conflicts file",
+}
 
-        print(
-            f"Card (l{cards[i]['level']}):\n\ten: {cards[i]['english']}\n\tpy: {cards[i]['pinyin']}\n\tzh: {cards[i]['chinese']}"
-        )
 
-        if not determine:
-            print("Unable to determine grammar type.")
-        eng = input("\tverdict: ").strip()
-        if eng == "":
-            cards[i]["english"] = cards[i]["english"]
-        elif eng.startswith("UP"):
-            i -= int(eng[2:])
-            if i < 0:
-                i = 0
-            continue
-        else:
-            cards[i]["english"] = eng
-        i += 1
-    print("All done!")
-    json.dump(cards, open(file, "w"), ensure_ascii=False)
-    os.system("npx prettier --write cards.json")
+def _card_level(card):
+    """Level of a card as an int; cards without a usable level sort last."""
+    level = str(card.get("level", ""))
+    return int(level) if level.isdigit() else math.inf
 
 
-def custom(file, lesson=None):
+def _resolve(versions, policy):
     """
-    Import custom vocabulary interactively into a JSON file.
-    The user enters vocabulary details. Use numbered pinyin (e.g. ni3hao2);
-    type 'EXIT_PROG' in the English field to terminate import,
-    and 'DEL{N}' (e.g. DEL2) to delete the last N cards.
+    Resolve one conflict under a merge policy.
 
     Args:
-      file: Output JSON file for the custom vocabulary.
-      lesson: (Optional) Default lesson number for all entries.
-    """
+      versions: Distinct cards for one Chinese key, truth.json's version (if
+                any) first, then incoming versions in the order they were read.
+      policy: One of MERGE_POLICIES.
 
-    def convert_pinyin(
-        numbered_pinyin: str,
-    ) -> str:  # WARNING: AI-generated code, use with caution
-        tone_map = {
-            "a": ["a", "ā", "á", "ǎ", "à", "a"],
-            "e": ["e", "ē", "é", "ě", "è", "e"],
-            "i": ["i", "ī", "í", "ǐ", "ì", "i"],
-            "o": ["o", "ō", "ó", "ǒ", "ò", "o"],
-            "u": ["u", "ū", "ú", "ǔ", "ù", "u"],
-            "ü": ["ü", "ǖ", "ǘ", "ǚ", "ǜ", "ü"],
-        }
-        """Convert numbered pinyin to pinyin with tone marks."""
-        # Replace 'v' with 'ü'
-        numbered_pinyin = numbered_pinyin.lower().replace("v", "ü")
-
-        # Split into syllables
-        syllables = numbered_pinyin.split()
-        result = []
-
-        for syllable in syllables:
-            # Extract tone number (default to 0 if no tone number)
-            tone = 0
-            for i in range(len(syllable)):
-                if syllable[i] in "12345":
-                    tone = int(syllable[i])
-                    syllable = syllable[:i] + syllable[i + 1 :]
-                    break
-
-            # Find the vowel to modify based on precedence
-            vowels = "aeoiuü"
-            vowel_positions = [(c, i) for i, c in enumerate(syllable) if c in vowels]
-            if not vowel_positions:
-                result.append(syllable)
-                continue
+    Returns:
+      The resolved card, or None if the policy cannot decide.
+    """
+    if policy == "prefer-incoming":
+        return versions[-1]
+    if policy == "prefer-truth":
+        return versions[0]
+    if policy == "lowest-level":
+        lowest = min(map(_card_level, versions))
+        winners = [card for card in versions if _card_level(card) == lowest]
+        return winners[0] if len(winners) == 1 else None
+    if policy == "concat":
+        definitions = []
+        for card in versions:
+            for definition in card["english"].split("; "):
+                if definition not in definitions:
+                    definitions.append(definition)
+        card = dict(versions[0])
+        card["english"] = "; ".join(definitions)
+        lowest = min(map(_card_level, versions))
+        if lowest != math.inf:
+            card["level"] = lowest
+        return card
+    return None
 
-            # Apply precedence rules (a > o > e > i > u > ü)
-            vowel_to_change = min(vowel_positions, key=lambda x: vowels.index(x[0]))
-            vowel, position = vowel_to_change
 
-            # Replace the vowel with its toned version
-            new_vowel = tone_map[vowel][tone]
-            new_syllable = syllable[:position] + new_vowel + syllable[position + 1 :]
-            result.append(new_syllable)
+def merge_batch(
+    files,
+    policy,
+    truth="truth.json",
+    output="truth.json",
+    conflicts_file=None,
+    db=None,
+    duplicates_file=None,
+):
+    """
+    Merge vocabulary JSON files into the ground truth without any prompts.
+    All files are folded into one dict keyed by the Chinese string in a
+    single pass; identical duplicates are dropped and the remaining
+    conflicts are settled by the given policy. Conflicts the policy cannot
+    decide keep the truth (or first) version and are written, with every
+    version, to conflicts_file.
 
-        return " ".join(result)
+    Args:
+      files: Vocabulary JSON files (lists of cards) to merge, in order.
+      policy: One of MERGE_POLICIES.
+      truth: Ground truth JSON file to merge into.
+      output: File to write the merged ground truth to.
+      conflicts_file: Optional JSON file for unresolved conflicts.
+      db: Optional SQLite store to merge into instead of truth/output. Only
+          the keys present in the input files are read, and they are read
+          and the results upserted in a single (immediate) transaction.
+      duplicates_file: Optional JSON file for clusters of near-duplicate
+          cards under different keys (lists of cards; see find_duplicates).
+
+    Returns:
+      A (resolved, unresolved) tuple of conflict counts.
+    """
+    conn = None
+    with stage("load") as info:
+        if db is not None:
+            conn = open_store(db)
+            # read and upsert in one write transaction, so that a concurrent
+            # merge cannot resolve against the same old rows and lose an update
+            conn.execute("BEGIN IMMEDIATE")
+            ground = CardStore()
+        else:
+            ground = CardStore.load(truth) if os.path.exists(truth) else CardStore()
+        info["cards"] = len(ground)
+    try:
+        conflicts = {}
+        with stage("fold") as info:
+            info["cards"] = 0
+            for file in files:
+                with open(file, encoding="utf-8") as f:
+                    incoming = json.load(f)
+                for card in incoming:
+                    info["cards"] += 1
+                    key = card["chinese"]
+                    if conn is not None and key not in ground:
+                        stored = store_get(conn, key)
+                        if stored is not None:
+                            ground[key] = stored
+                    if key not in ground:
+                        ground[key] = card
+                    elif key in conflicts:
+                        if card not in conflicts[key]:
+                            conflicts[key].append(card)
+                    elif card != ground[key]:
+                        conflicts[key] = [ground[key].to_dict(), card]
+        unresolved = {}
+        with stage("resolve") as info:
+            info["conflicts"] = len(conflicts)
+            for key, versions in conflicts.items():
+                card = _resolve(versions, policy)
+                if card is None:
+                    unresolved[key] = versions
+                else:
+                    ground[key] = card
+        with stage("write") as info:
+            info["cards"] = len(ground)
+            if conn is not None:
+                store_upsert(conn, ground.values())
+            else:
+                dump_json(ground, output)
+            if conflicts_file is not None:
+                dump_json(unresolved, conflicts_file)
+    finally:
+        if conn is not None:
+            conn.rollback()  # a no-op once store_upsert has committed
+            conn.close()
+    if duplicates_file is not None:
+        with stage("near-duplicates") as info:
+            clusters = duplicate_clusters(ground)
+            info["clusters"] = len(clusters)
+            dump_json(
+                [[ground[key].to_dict() for key in keys] for keys in clusters],
+                duplicates_file,
+            )
+    return len(conflicts) - len(unresolved), len(unresolved)
+
+
+_POS_TOKEN = "|".join(
+    map(re.escape, sorted({*matches, *matches.values()}, key=len, reverse=True))
+)
+# a grammar type prefix: comma-separated parts, each one or more known
+# (abbreviated or expanded) types joined by '+', ended by the first ':'
+_POS_HEAD = re.compile(rf"\s*((?:{_POS_TOKEN})(?:\s*[,+]\s*(?:{_POS_TOKEN}))*)\s*:")
+_POS_SPLIT = re.compile(r"\s*([,+])\s*")
+
+
+def normalize_pos(english):
+    """
+    Expand and validate the grammar type prefix of an English definition
+    (adj: big -> adjective: big, n+m: day -> noun + measure word: day).
+
+    Returns:
+      A (english, pos) tuple: the definition with its prefix expanded, and
+      the expanded prefix, or (english, None) if the prefix is missing or
+      not made of known grammar types.
+    """
+    match = _POS_HEAD.match(english)
+    if match is None:
+        return english, None
+    pos = "".join(
+        ", " if part == "," else " + " if part == "+" else matches.get(part, part)
+        for part in _POS_SPLIT.split(match.group(1))
+    )
+    return f"{pos}:{english[match.end() :]}", pos
+
+
+def vocab_files(paths):
+    """Expand a mix of vocabulary files and directories into JSON files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            files.append(path)
+    return files
+
+
+def _parallel_map(func, *iterables, jobs=None, initializer=None, initargs=()):
+    """
+    list(map(func, *iterables)) in worker processes. A single item is
+    handled in this process, without the cost of starting a pool.
+
+    Args:
+      func: Picklable (module-level) function.
+      iterables: Argument lists, as for map.
+      jobs: Number of worker processes (default: one per core).
+      initializer, initargs: Run in each worker (and in this process for
+                             a single item) before func.
+    """
+    calls = list(zip(*iterables, strict=True))
+    if len(calls) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [func(*args) for args in calls]
+    with ProcessPoolExecutor(jobs, initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(func, *zip(*calls, strict=True)))
+
+
+CHUNK_CARDS = 2000  # fewest cards of a deck worth sending to a worker process
+
+
+def _card_chunks(cards, jobs=None):
+    """
+    Split the cards of a CardStore into (start, cards) chunks of plain
+    dicts, a few per worker process, for _parallel_map. Decks smaller than
+    CHUNK_CARDS make a single chunk.
+    """
+    cards = [card.to_dict() for card in cards.values()]
+    per_chunk = -(-len(cards) // (4 * (jobs or os.cpu_count() or 1)))
+    size = max(CHUNK_CARDS, per_chunk)
+    return [
+        (start, cards[start : start + size]) for start in range(0, len(cards), size)
+    ]
+
+
+def _sorted_run(index, file):
+    """
+    Load one vocabulary file as a run for consolidate: (chinese, index,
+    position, card) tuples sorted by chinese, then position in the file.
+    """
+    return sorted(
+        (card["chinese"], index, position, card)
+        for position, card in enumerate(load_cards(file))
+    )
+
+
+def consolidate(
+    paths,
+    policy="lowest-level",
+    truth="truth.json",
+    output="truth.json",
+    conflicts_file=None,
+    jobs=None,
+):
+    """
+    Merge a whole directory of vocabulary files into the ground truth in a
+    single pass. Every file is loaded and sorted by chinese in a worker
+    process; the sorted runs are then merged k ways (heapq.merge), so all
+    versions of a key arrive together and are deduplicated and resolved
+    by policy exactly as merge_batch does. Cards new to the ground truth
+    are appended in level order, and the output is written once.
+
+    Args:
+      paths: Vocabulary JSON files and/or directories of them (e.g. user/).
+      policy: One of MERGE_POLICIES.
+      truth: Ground truth JSON file to merge into.
+      output: File to write the consolidated ground truth to.
+      conflicts_file: Optional JSON file for unresolved conflicts.
+      jobs: Number of worker processes (default: one per core).
+
+    Returns:
+      An (added, resolved, unresolved) tuple of counts.
+    """
+    files = vocab_files(paths)
+    with stage("load") as info:
+        ground = CardStore.load(truth) if os.path.exists(truth) else CardStore()
+        runs = _parallel_map(_sorted_run, range(len(files)), files, jobs=jobs)
+        info["files"] = len(files)
+        info["cards"] = len(ground) + sum(map(len, runs))
+    new, resolved, unresolved = [], 0, {}
+    with stage("merge") as info:
+        groups = itertools.groupby(heapq.merge(*runs), key=lambda entry: entry[0])
+        for key, entries in groups:
+            # entries arrive in file order, then position within the file
+            versions = [ground[key].to_dict()] if key in ground else []
+            first = None
+            for _, index, position, card in entries:
+                first = first or (index, position)
+                if card not in versions:
+                    versions.append(card)
+            card = versions[0]
+            if len(versions) > 1:
+                card = _resolve(versions, policy)
+                if card is None:
+                    unresolved[key] = versions
+                    card = versions[0]
+                else:
+                    resolved += 1
+            if key in ground:
+                ground[key] = card
+            else:
+                new.append((_card_level(card), first, key, card))
+        new.sort(key=lambda entry: entry[:2])
+        for _, _, key, card in new:
+            ground[key] = card
+        info["conflicts"] = resolved + len(unresolved)
+    with stage("write") as info:
+        info["cards"] = len(ground)
+        dump_json(ground, output)
+        if conflicts_file is not None:
+            dump_json(unresolved, conflicts_file)
+    return len(new), resolved, len(unresolved)
+
+
+@functools.cache
+def traditional_map(src="ic_truth.json"):
+    """
+    Traditional -> simplified characters, learned from the headwords of the
+    Pleco dump that come in both charsets. Empty if src does not exist.
+    """
+    mapping = {}
+    if not os.path.exists(src):
+        return mapping
+    with open(src, encoding="utf-8") as f:
+        dump = json.load(f)
+    for card in dump["plecoflash"]["cards"]["card"]:
+        headword = card["entry"]["headword"]
+        if isinstance(headword, str) or len(headword[0]) == 1:
+            continue
+        forms = {form["+@charset"]: form["+content"] for form in headword}
+        tc, sc = forms.get("tc", ""), forms.get("sc", "")
+        if len(tc) == len(sc):
+            mapping.update((t, s) for t, s in zip(tc, sc, strict=True) if t != s)
+    return mapping
+
+
+DUP_STOPWORDS = frozenset({"a", "an", "the", "to", "of", "be", "one's", "sb", "sth"})
+
+
+def _dup_features(card, simplify):
+    """
+    Normalized features of a card for near-duplicate detection: simplified
+    characters and their bigrams, toneless pinyin syllables (so spacing
+    and tone marks do not matter) and the English words without the
+    grammar type prefix. An erhua 儿/r suffix is ignored.
+
+    Returns:
+      A (simplified chinese, features) tuple.
+    """
+    chinese = "".join(filter(is_cjk, card.get("chinese", ""))).translate(simplify)
+    pinyin = card.get("pinyin", "")
+    syllables = segment_pinyin(pinyin)
+    chars = chinese
+    if syllables and syllables[-1][0] == "r" and chars.endswith("儿"):
+        chars, syllables = chars[:-1], syllables[:-1]
+    features = {f"zh:{char}" for char in chars}
+    features.update(f"zb:{gram}" for gram in _ngrams(chars, 2))
+    if syllables is None:
+        features.update(f"py:{word}" for word in toneless_pinyin(pinyin).split())
+    else:
+        features.update(f"py:{syllable}" for syllable, _ in syllables)
+    english, pos = normalize_pos(card.get("english", ""))
+    if pos is not None:
+        english = english[len(pos) + 1 :]
+    words = re.findall(r"[a-z0-9']+", english.lower())
+    features.update(f"en:{word}" for word in words if word not in DUP_STOPWORDS)
+    return chinese, features
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        if parent != item:
+            parent = self.parent[item] = self.find(parent)
+        return parent
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+MINHASH_BANDS = 5  # LSH bands of MINHASH_ROWS MinHash values each
+MINHASH_ROWS = 3
+
+
+def find_duplicates(cards, threshold=0.6, src="ic_truth.json", max_bucket=50):
+    """
+    Cluster near-duplicate cards without comparing every pair. Each card's
+    normalized features (_dup_features) get a MinHash signature; cards that
+    agree on all values of any LSH band become candidates, candidates are
+    verified by the Jaccard similarity of their features (or identical
+    simplified characters), and verified pairs are joined with union-find.
+
+    Args:
+      cards: Iterable of cards (e.g. CardStore.values()).
+      threshold: Minimum feature Jaccard similarity of a duplicate pair.
+      src: Pleco dump the traditional -> simplified table is learned from.
+      max_bucket: LSH buckets larger than this (features shared by very many
+                  cards) are not expanded into pairs.
+
+    Returns:
+      List of clusters, each a list of two or more card positions (in the
+      order cards were given), ordered by their first position.
+    """
+    simplify = str.maketrans(traditional_map(src))
+    hashes = {}
+    width = MINHASH_BANDS * MINHASH_ROWS
+    features, buckets = [], collections.defaultdict(list)
+    for i, card in enumerate(cards):
+        chinese, feats = _dup_features(card, simplify)
+        features.append((chinese, feats))
+        if not feats:
+            continue
+        for feat in feats:
+            if feat not in hashes:
+                digest = hashlib.blake2b(feat.encode(), digest_size=4 * width)
+                hashes[feat] = array.array("I", digest.digest())
+        signature = list(map(min, zip(*(hashes[feat] for feat in feats), strict=True)))
+        for band in range(MINHASH_BANDS):
+            rows = signature[band * MINHASH_ROWS : (band + 1) * MINHASH_ROWS]
+            buckets[(band, *rows)].append(i)
+    groups = _UnionFind()
+    checked = set()
+    for members in buckets.values():
+        if len(members) < 2 or len(members) > max_bucket:
+            continue
+        for a, b in itertools.combinations(members, 2):
+            if (a, b) in checked:
+                continue
+            checked.add((a, b))
+            (chinese_a, feats_a), (chinese_b, feats_b) = features[a], features[b]
+            if chinese_a and chinese_a == chinese_b:
+                groups.union(a, b)
+                continue
+            small, large = sorted((len(feats_a), len(feats_b)))
+            if small < threshold * large:
+                continue  # the Jaccard similarity is at most small / large
+            shared = len(feats_a & feats_b)
+            if shared >= threshold * (small + large - shared):
+                groups.union(a, b)
+    clusters = collections.defaultdict(list)
+    for i in list(groups.parent):
+        clusters[groups.find(i)].append(i)
+    return sorted(sorted(cluster) for cluster in clusters.values())
+
+
+def resolve_duplicates(ground, clusters):
+    """
+    Interactively resolve near-duplicate clusters of a CardStore: for each
+    cluster, keep every card or name the ones to delete.
+
+    Args:
+      ground: CardStore the clusters were found in.
+      clusters: Clusters of truth keys.
+    """
+    for cluster in clusters:
+        print("========== NEAR DUPLICATES ==========")
+        for i, key in enumerate(cluster, 1):
+            card = ground[key]
+            print(f"**** V{i}: ****")
+            print(f"\teng: {card.get('english')}")
+            print(f"\tpin: {card.get('pinyin')}")
+            print(f"\tchi: {card.get('chinese')}")
+            print(f"\tlev: {card.get('level')}")
+        while True:
+            drop = input("Versions to delete, e.g. 2,3 (enter keeps all): ").strip()
+            numbers = [part.strip() for part in drop.split(",") if part.strip()]
+            if all(n.isdigit() and 1 <= int(n) <= len(cluster) for n in numbers):
+                break
+            print("Invalid input. Please enter version numbers.")
+        for n in sorted(set(map(int, numbers))):
+            del ground[cluster[n - 1]]
+
+
+def duplicate_clusters(ground, threshold=0.6):
+    """Near-duplicate clusters of a deck (dict or CardStore) as lists of its keys."""
+    keys = list(ground)
+    return [
+        [keys[i] for i in cluster]
+        for cluster in find_duplicates(ground.values(), threshold)
+    ]
+
+
+def _card_pos(english):
+    """Expanded part of speech of a card (see normalize_pos), or ''."""
+    return normalize_pos(english)[1] or ""
+
+
+def open_store(db=TRUTH_DB):
+    """
+    Open the SQLite ground truth store, creating its schema if needed. Each
+    card is kept verbatim as JSON alongside indexed chinese, pinyin, level
+    and part-of-speech columns; rows keep their insertion order, so a
+    round trip through the store reproduces truth.json exactly.
+
+    Args:
+      db: SQLite database file.
+
+    Returns:
+      An open sqlite3.Connection.
+    """
+    conn = sqlite3.connect(db)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY,
+            chinese TEXT NOT NULL UNIQUE,
+            pinyin TEXT NOT NULL,
+            level INTEGER,
+            pos TEXT NOT NULL,
+            card TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cards_pinyin ON cards (pinyin);
+        CREATE INDEX IF NOT EXISTS cards_level ON cards (level);
+        CREATE INDEX IF NOT EXISTS cards_pos ON cards (pos);
+        """
+    )
+    return conn
+
+
+def store_upsert(conn, cards):
+    """
+    Insert or update cards (keyed by chinese) in one transaction. Updated
+    cards keep their position in the store.
+
+    Returns:
+      Number of cards written.
+    """
+    rows = [
+        (
+            card["chinese"],
+            card.get("pinyin", ""),
+            None if _card_level(card) == math.inf else _card_level(card),
+            _card_pos(card.get("english", "")),
+            json.dumps(dict(card), ensure_ascii=False),
+        )
+        for card in cards
+    ]
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO cards (chinese, pinyin, level, pos, card)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (chinese) DO UPDATE SET
+                pinyin = excluded.pinyin,
+                level = excluded.level,
+                pos = excluded.pos,
+                card = excluded.card
+            """,
+            rows,
+        )
+    return len(rows)
+
+
+def store_get(conn, chinese):
+    """Return the card stored under the given Chinese key, or None."""
+    query = "SELECT card FROM cards WHERE chinese = ?"
+    row = conn.execute(query, (chinese,)).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def store_cards(conn, min_level=None, max_level=None, pos=None, pinyin=None):
+    """
+    Yield cards from the store in insertion order, using the column indexes
+    for the optional level range, part of speech and pinyin filters.
+
+    Args:
+      min_level, max_level: Optional inclusive level bounds.
+      pos: Optional part of speech (e.g. 'verb'); matches any card whose
+           grammar types include it.
+      pinyin: Optional exact pinyin.
+    """
+    where, params = [], []
+    if min_level is not None:
+        where.append("level >= ?")
+        params.append(min_level)
+    if max_level is not None:
+        where.append("level <= ?")
+        params.append(max_level)
+    if pos is not None:
+        where.append(
+            "(pos = ? OR pos LIKE ? ESCAPE '\\' OR pos LIKE ? ESCAPE '\\'"
+            " OR pos LIKE ? ESCAPE '\\')"
+        )
+        like = re.sub(r"([\\%_])", r"\\\1", pos)
+        params += [pos, f"{like}, %", f"%, {like}", f"%, {like}, %"]
+    if pinyin is not None:
+        where.append("pinyin = ?")
+        params.append(pinyin)
+    query = "SELECT card FROM cards"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    for (card,) in conn.execute(query + " ORDER BY id", params):
+        yield json.loads(card)
+
+
+def store_import(file="truth.json", db=TRUTH_DB):
+    """
+    Load a truth.json-style file (dict keyed by chinese) into the store.
+
+    Returns:
+      Number of cards imported.
+    """
+    conn = open_store(db)
+    try:
+        with stage("import") as info:
+            info["cards"] = store_upsert(conn, load_cards(file))
+        return info["cards"]
+    finally:
+        conn.close()
+
+
+def store_export(db=TRUTH_DB, file="truth.json", **filters):
+    """
+    Write the store (or the part selected by store_cards filters) back out
+    in the truth.json format.
+
+    Returns:
+      Number of cards exported.
+    """
+    conn = open_store(db)
+    try:
+        with stage("query") as info:
+            ground = {card["chinese"]: card for card in store_cards(conn, **filters)}
+            info["cards"] = len(ground)
+    finally:
+        conn.close()
+    with stage("write"):
+        dump_json(ground, file)
+    return len(ground)
+
+
+# Snapshot layout (little-endian): a header, then the string pool, one
+# record per card (offset and length of its key, pinyin key and compact card
+# JSON in the pool), two tables of record numbers, sorted by key and by
+# pinyin key (toneless, unspaced) bytes, and the level index: the usable
+# levels in ascending order followed by their record numbers. The header
+# keeps the source's mtime and size, so a stale snapshot can be told apart.
+_SNAPSHOT_MAGIC = b"VOCSNAP2"
+# magic, cards, cards with a level, source mtime_ns and size, 5 section offsets
+_SNAPSHOT_HEADER = struct.Struct("<8sIIqQQQQQQ")
+_SNAPSHOT_RECORD = struct.Struct("<6I")
+_SNAPSHOT_ENTRY = struct.Struct("<I")
+_SNAPSHOT_LEVEL = struct.Struct("<q")
+
+
+def _pinyin_key(pinyin):
+    """Lookup form of pinyin: toneless, unspaced (lǎo shī / lao3shi1 -> laoshi)."""
+    return "".join(toneless_pinyin(pinyin).split()).replace("'", "")
+
+
+def write_snapshot(src="truth.json", file=SNAPSHOT):
+    """
+    Compile a deck into a read-only binary snapshot (see Snapshot).
+
+    Returns:
+      Number of cards written.
+    """
+    stat = os.stat(src)
+    with open(src, encoding="utf-8") as f:
+        cards = json.load(f)
+    pool, records, keys, pinyins, levels = bytearray(), [], [], [], []
+
+    def intern(data):
+        pool.extend(data)
+        return len(pool) - len(data), len(data)
+
+    with stage("compile") as info:
+        for i, (chinese, card) in enumerate(cards.items()):
+            key = chinese.encode("utf-8")
+            pinyin = _pinyin_key(card.get("pinyin", "")).encode("utf-8")
+            data = json.dumps(card, ensure_ascii=False, separators=(",", ":"))
+            records.append((*intern(key), *intern(pinyin), *intern(data.encode())))
+            keys.append((key, i))
+            pinyins.append((pinyin, i))
+            if (level := _card_level(card)) != math.inf:
+                levels.append((level, i))
+        keys.sort()
+        pinyins.sort()
+        levels.sort()
+        info["cards"] = len(records)
+    with stage("write"), _atomic_open(file, "wb") as f:
+        records_at = _SNAPSHOT_HEADER.size + len(pool)
+        by_key_at = records_at + len(records) * _SNAPSHOT_RECORD.size
+        by_pinyin_at = by_key_at + len(records) * _SNAPSHOT_ENTRY.size
+        by_level_at = by_pinyin_at + len(records) * _SNAPSHOT_ENTRY.size
+        f.write(
+            _SNAPSHOT_HEADER.pack(
+                _SNAPSHOT_MAGIC,
+                len(records),
+                len(levels),
+                stat.st_mtime_ns,
+                stat.st_size,
+                _SNAPSHOT_HEADER.size,
+                records_at,
+                by_key_at,
+                by_pinyin_at,
+                by_level_at,
+            )
+        )
+        f.write(pool)
+        for record in records:
+            f.write(_SNAPSHOT_RECORD.pack(*record))
+        for table in (keys, pinyins):
+            f.write(array.array("I", (i for _, i in table)).tobytes())
+        for level, _ in levels:
+            f.write(_SNAPSHOT_LEVEL.pack(level))
+        f.write(array.array("I", (i for _, i in levels)).tobytes())
+    return len(records)
+
+
+class Snapshot(collections.abc.Mapping):
+    """
+    Read-only deck on a memory-mapped snapshot (write_snapshot). Nothing is
+    parsed up front: lookups binary-search the sorted tables in place and
+    decode only the cards they return, so any number of processes can
+    share one page-cached copy of the deck.
+
+    The snapshot is a mapping from truth key to card dict like truth.json
+    (snapshot[key], key in snapshot, iteration in deck order),
+    lookup_pinyin finds cards by pinyin regardless of tones and spacing,
+    and rows answers level ranges like CardStore.rows.
+    """
+
+    def __init__(self, file=SNAPSHOT):
+        with open(file, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+            self._map.close()
+            raise ValueError(f"{file} is not a current vocabulary snapshot")
+        (
+            _,
+            self._count,
+            self._levelled,
+            mtime,
+            size,
+            self._pool,
+            self._records,
+            by_key,
+            by_pinyin,
+            self._levels,
+        ) = _SNAPSHOT_HEADER.unpack_from(self._map)
+        self.source = (mtime, size)  # st_mtime_ns and st_size of the deck
+        self._tables = (by_key, by_pinyin)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record(self, i):
+        return _SNAPSHOT_RECORD.unpack_from(
+            self._map, self._records + i * _SNAPSHOT_RECORD.size
+        )
+
+    def _string(self, offset, length):
+        start = self._pool + offset
+        return self._map[start : start + length]
+
+    def _search(self, table, field, value):
+        """Range of positions in table (0: by key, 1: by pinyin) whose record
+        field (0: key, 1: pinyin key) bytes equal value."""
+        start = self._tables[table]
+
+        def entry(pos):
+            (i,) = _SNAPSHOT_ENTRY.unpack_from(
+                self._map, start + pos * _SNAPSHOT_ENTRY.size
+            )
+            return i
+
+        def field_at(pos):
+            record = self._record(entry(pos))
+            return self._string(*record[2 * field : 2 * field + 2])
+
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if field_at(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        end = lo
+        while end < self._count and field_at(end) == value:
+            end += 1
+        return [entry(pos) for pos in range(lo, end)]
+
+    def _card(self, i):
+        return json.loads(self._string(*self._record(i)[4:6]))
+
+    def rows(self, min_level=None, max_level=None):
+        """
+        Record numbers (deck order) of the cards with a level in
+        [min_level, max_level], binary-searched in the level index.
+        """
+        if min_level is None and max_level is None:
+            return list(range(self._count))
+
+        def level_at(pos):
+            offset = self._levels + pos * _SNAPSHOT_LEVEL.size
+            return _SNAPSHOT_LEVEL.unpack_from(self._map, offset)[0]
+
+        positions = range(self._levelled)
+        lo, hi = 0, self._levelled
+        if min_level is not None:
+            lo = bisect.bisect_left(positions, min_level, key=level_at)
+        if max_level is not None:
+            hi = bisect.bisect_right(positions, max_level, key=level_at)
+        start = self._levels + self._levelled * _SNAPSHOT_LEVEL.size
+        entries = self._map[
+            start + lo * _SNAPSHOT_ENTRY.size : start + hi * _SNAPSHOT_ENTRY.size
+        ]
+        return sorted(array.array("I", entries))
+
+    def __getitem__(self, key):
+        found = self._search(0, 0, key.encode("utf-8"))
+        if not found:
+            raise KeyError(key)
+        return self._card(found[0])
+
+    def __contains__(self, key):
+        return bool(self._search(0, 0, key.encode("utf-8")))
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._string(*self._record(i)[0:2]).decode("utf-8")
+
+    def __len__(self):
+        return self._count
+
+    def lookup_pinyin(self, pinyin):
+        """Cards (in deck order) whose pinyin matches ignoring tones, spaces
+        and apostrophes (laoshi, lao3shi1 and lǎo shī all find 老师)."""
+        found = self._search(1, 1, _pinyin_key(pinyin).encode("utf-8"))
+        return [self._card(i) for i in sorted(found)]
+
+
+def current_snapshot(src="truth.json", file=SNAPSHOT):
+    """
+    The Snapshot of src in file, or None if there is none or src has
+    changed (mtime or size) since it was written.
+    """
+    try:
+        snapshot = Snapshot(file)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(src)
+    if snapshot.source != (stat.st_mtime_ns, stat.st_size):
+        snapshot.close()
+        return None
+    return snapshot
+
+
+# a word list too long to spell one string per line
+PINYIN_SYLLABLES = frozenset(
+    """
+    a ai an ang ao ba bai ban bang bao bei ben beng bi bian biao bie bin bing bo bu
+    ca cai can cang cao ce cen ceng cha chai chan chang chao che chen cheng chi
+    chong chou chu chua chuai chuan chuang chui chun chuo ci cong cou cu cuan cui
+    cun cuo da dai dan dang dao de dei den deng di dia dian diao die ding diu dong
+    dou du duan dui dun duo e ei en eng er fa fan fang fei fen feng fo fou fu ga gai
+    gan gang gao ge gei gen geng gong gou gu gua guai guan guang gui gun guo ha hai
+    han hang hao he hei hen heng hm hng hong hou hu hua huai huan huang hui hun huo
+    ji jia jian jiang jiao jie jin jing jiong jiu ju juan jue jun ka kai kan kang
+    kao ke kei ken keng kong kou ku kua kuai kuan kuang kui kun kuo la lai lan lang
+    lao le lei leng li lia lian liang liao lie lin ling liu lo long lou lu luan lun
+    luo lü lüe m ma mai man mang mao me mei men meng mi mian miao mie min ming miu
+    mo mou mu n na nai nan nang nao ne nei nen neng ng ni nian niang niao nie nin
+    ning niu nong nou nu nuan nuo nü nüe o ou pa pai pan pang pao pei pen peng pi
+    pian piao pie pin ping po pou pu qi qia qian qiang qiao qie qin qing qiong qiu
+    qu quan que qun ran rang rao re ren reng ri rong rou ru rua ruan rui run ruo sa
+    sai san sang sao se sen seng sha shai shan shang shao she shei shen sheng shi
+    shou shu shua shuai shuan shuang shui shun shuo si song sou su suan sui sun suo
+    ta tai tan tang tao te teng ti tian tiao tie ting tong tou tu tuan tui tun tuo
+    wa wai wan wang wei wen weng wo wu xi xia xian xiang xiao xie xin xing xiong xiu
+    xu xuan xue xun ya yan yang yao ye yi yin ying yo yong you yu yuan yue yun za
+    zai zan zang zao ze zei zen zeng zha zhai zhan zhang zhao zhe zhei zhen zheng
+    zhi zhong zhou zhu zhua zhuai zhuan zhuang zhui zhun zhuo zi zong zou zu zuan
+    zui zun zuo
+    """.split()  # noqa: SIM905
+)
+TONE_MARKS = {
+    "a": "āáǎà",
+    "e": "ēéěè",
+    "i": "īíǐì",
+    "o": "ōóǒò",
+    "u": "ūúǔù",
+    "ü": "ǖǘǚǜ",
+}
+_UNMARK = {
+    mark: (vowel, tone + 1)
+    for vowel, marks in TONE_MARKS.items()
+    for tone, mark in enumerate(marks)
+}
+_PINYIN_TOKEN = re.compile(f"[a-zü{''.join(_UNMARK)}1-5]+")
+
+
+def _mark_syllable(syllable, tone):
+    """Put the tone mark on the right vowel: a/e first, then the o of ou,
+    otherwise the last vowel."""
+    if tone not in (1, 2, 3, 4):
+        return syllable
+    if "a" in syllable:
+        i = syllable.index("a")
+    elif "e" in syllable:
+        i = syllable.index("e")
+    elif "ou" in syllable:
+        i = syllable.index("o")
+    else:
+        vowels = [i for i, char in enumerate(syllable) if char in TONE_MARKS]
+        if not vowels:
+            return syllable
+        i = vowels[-1]
+    return syllable[:i] + TONE_MARKS[syllable[i]][tone - 1] + syllable[i + 1 :]
+
+
+# every syllable in every tone (5 = neutral), plus the erhua suffix
+MARKED_SYLLABLES = {
+    (syllable, tone): _mark_syllable(syllable, tone)
+    for syllable in PINYIN_SYLLABLES | {"r"}
+    for tone in range(1, 6)
+}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _segment_pinyin(token):
+    """
+    Split one lowercase pinyin token (numbered, marked or toneless, spaced or
+    not) into (syllable, tone) pairs, or None if it is not valid pinyin.
+    Tone digits end a syllable and each syllable takes at most one tone; a
+    digit after an erhua r belongs to the syllable before it (nar3 is nǎr).
+    Of the valid splits, the one with the fewest syllables starting with a, e
+    or o (which would need an apostrophe) and then the fewest syllables wins,
+    so "xian" stays one syllable and "fangan" reads fan gan.
+    """
+    base, marks, ends = [], {}, {}
+    for char in token.replace("u:", "ü").replace("v", "ü"):
+        if char in "12345":
+            ends[len(base)] = int(char)
+        elif char in _UNMARK:
+            vowel, tone = _UNMARK[char]
+            marks[len(base)] = tone
+            base.append(vowel)
+        else:
+            base.append(char)
+    base = "".join(base)
+    best = [None] * (len(base) + 1)
+    best[0] = (0, 0, None, None, None)
+    for i in range(len(base)):
+        if best[i] is None:
+            continue
+        marked = []
+        for j in range(i + 1, min(i + 6, len(base)) + 1):
+            if j - 1 > i and j - 1 in ends:
+                break  # a tone digit inside the syllable
+            if j - 1 in marks:
+                marked.append(marks[j - 1])
+                if len(marked) > 1:
+                    break
+            syllable = base[i:j]
+            if syllable not in PINYIN_SYLLABLES and (
+                syllable != "r" or (i == 0 and len(base) > 1)
+            ):
+                continue
+            tones = [*marked, ends[j]] if j in ends else marked
+            if len(tones) > 1 or (syllable == "r" and tones and best[i][4] != 5):
+                continue
+            cost = (
+                best[i][0] + (i > 0 and syllable[0] in "aeo"),
+                best[i][1] + 1,
+            )
+            if best[j] is None or cost < best[j][:2]:
+                best[j] = (*cost, i, syllable, tones[0] if tones else 5)
+    if best[-1] is None:
+        return None
+    syllables, j, erhua_tone = [], len(base), 5
+    while j:
+        _, _, i, syllable, tone = best[j]
+        if syllable == "r":
+            syllables.append((syllable, 5))
+            erhua_tone = tone
+        else:
+            syllables.append((syllable, tone if erhua_tone == 5 else erhua_tone))
+            erhua_tone = 5
+        j = i
+    return tuple(reversed(syllables))
+
+
+_PINYIN_TOKEN_ANY_CASE = re.compile(_PINYIN_TOKEN.pattern, re.IGNORECASE)
+
+
+def _recase(source, converted):
+    """Give the letters of converted the case of the letters of source, the
+    token it was converted from (Běijīng <-> Bei3jing1)."""
+    upper = [char.isupper() for char in source if char.isalpha()]
+    if sum(map(str.isalpha, converted)) != len(upper):
+        return converted
+    flags = iter(upper)
+    return "".join(
+        char.upper() if char.isalpha() and next(flags) else char for char in converted
+    )
+
+
+def _pinyin_sub(text, convert):
+    """Apply convert(token, syllables) to every pinyin token of text, on the
+    lowercase token; capitals are put back afterwards."""
+
+    def replace(match):
+        token = match.group()
+        lower = token.lower()
+        converted = convert(lower, _segment_pinyin(lower))
+        return converted if token == lower else _recase(token, converted)
+
+    text = text.replace("u:", "ü").replace("U:", "Ü")
+    return _PINYIN_TOKEN_ANY_CASE.sub(replace, text)
+
+
+def _numbered(syllable, tone):
+    return syllable if syllable == "r" else f"{syllable}{tone}"
+
+
+def _to_marked(token, syllables):
+    if syllables is None:
+        # not segmentable: mark each digit-terminated chunk by the vowel rule
+        token = token.replace("u:", "ü").replace("v", "ü")
+        chunks = re.findall(r"([^1-5]*)([1-5]?)", token)
+        return "".join(_mark_syllable(chunk, int(tone or 5)) for chunk, tone in chunks)
+    # an apostrophe keeps a/e/o-initial syllables apart (fàng'àn, not fàngàn)
+    return "".join(
+        ("'" if i and syllable[0] in "aeo" else "") + MARKED_SYLLABLES[syllable, tone]
+        for i, (syllable, tone) in enumerate(syllables)
+    )
+
+
+def _to_numbered(token, syllables):
+    if syllables is None:
+        return token
+    return "".join(_numbered(*syllable) for syllable in syllables)
+
+
+def _to_spaced(token, syllables):
+    if syllables is None:
+        return _to_marked(token, None)
+    words = []
+    for syllable in syllables:
+        if syllable[0] == "r" and words:
+            words[-1] += MARKED_SYLLABLES[syllable]  # erhua: huàr, not huà r
+        else:
+            words.append(MARKED_SYLLABLES[syllable])
+    return " ".join(words)
+
+
+def numbered_to_marked(pinyin):
+    """
+    Convert numbered pinyin (ni3hao3, ni3 hao3, lu:4, nv3) to pinyin with
+    tone marks (nǐhǎo, nǐ hǎo, lǜ, nǚ). Whitespace between tokens is
+    normalized to single spaces; unspaced syllables stay unspaced, with an
+    apostrophe before a, e or o (fang4an4 -> fàng'àn).
+    """
+    return _pinyin_sub(" ".join(pinyin.split()), _to_marked)
+
+
+def marked_to_numbered(pinyin):
+    """Convert pinyin with tone marks to numbered pinyin (nǐhǎo -> ni3hao3,
+    Běijīng -> Bei3jing1; neutral tones get a 5). Tokens that are not valid
+    pinyin are kept; syllable apostrophes are not needed after a tone digit
+    (fàng'àn -> fang4an4)."""
+    return re.sub(r"(?<=[1-5])'(?=[^\W\d_])", "", _pinyin_sub(pinyin, _to_numbered))
+
+
+def spaced_pinyin(pinyin):
+    """Normalize any pinyin to tone marks with one space between syllables
+    (ni3hao3 / nǐhǎo -> nǐ hǎo)."""
+    return _pinyin_sub(pinyin, _to_spaced)
+
+
+def toneless_pinyin(pinyin):
+    """Strip tone marks and digits (nǐ hǎo / ni3 hao3 -> ni hao)."""
+    pinyin = pinyin.lower().replace("u:", "ü").replace("v", "ü")
+    return "".join(
+        _UNMARK[char][0] if char in _UNMARK else char
+        for char in pinyin
+        if char not in "12345"
+    )
+
+
+def segment_pinyin(pinyin):
+    """Split pinyin into its syllables as (syllable, tone) pairs, or return
+    None if any token is not valid pinyin."""
+    syllables = []
+    for token in _PINYIN_TOKEN.findall(pinyin.lower().replace("u:", "ü")):
+        segmented = _segment_pinyin(token)
+        if segmented is None:
+            return None
+        syllables.extend(segmented)
+    return syllables
+
+
+PINYIN_MODES = {
+    "marked": numbered_to_marked,
+    "numbered": marked_to_numbered,
+    "spaced": spaced_pinyin,
+    "toneless": toneless_pinyin,
+}
+
+
+def convert_pinyin_batch(items, mode="marked"):
+    """
+    Convert a whole list of pinyin strings in one call. Tokens are segmented
+    through a shared cache, so the many repeats in a deck cost one lookup.
+
+    Args:
+      items: Iterable of pinyin strings.
+      mode: One of PINYIN_MODES.
+
+    Returns:
+      List of converted strings.
+    """
+    return list(map(PINYIN_MODES[mode], items))
+
+
+def convert_pinyin_file(filein, fileout, mode="marked"):
+    """
+    Convert the pinyin in a file. JSON vocabulary files (lists of cards or
+    truth.json-style dicts) have the pinyin field of every card converted;
+    any other file is converted line by line.
+
+    Returns:
+      Number of cards or lines converted.
+    """
+    convert = PINYIN_MODES[mode]
+    if filein.endswith(".json"):
+        with open(filein, encoding="utf-8") as f:
+            data = json.load(f)
+        cards = data.values() if isinstance(data, dict) else data
+        with stage("convert") as info:
+            for card in cards:
+                card["pinyin"] = convert(card["pinyin"])
+            info["cards"] = len(data)
+        with stage("write"):
+            dump_json(data, fileout)
+        return len(data)
+    count = 0
+    with open(filein, encoding="utf-8") as f, _atomic_open(fileout) as out:
+        for line in f:
+            out.write(convert(line.rstrip("\n")) + "\n")
+            count += 1
+    return count
+
+
+def _normalize_chunk(start, cards):
+    """
+    Normalize a chunk of cards (see _card_chunks).
+
+    Returns:
+      (index, english, pos) tuples of the cards whose definition changes
+      or that stay unclassified (pos None), index counted from start.
+    """
+    changes = []
+    for index, card in enumerate(cards, start):
+        english, pos = normalize_pos(card["english"])
+        if pos is None or english != card["english"]:
+            changes.append((index, english, pos))
+    return changes
+
+
+def _normalize_file(filein, fileout, jobs=1):
+    """
+    Normalize the grammar type prefixes of one vocabulary file, its cards
+    split across jobs worker processes.
+
+    Returns:
+      A (cards, expanded, unclassified) tuple: the number of cards, the
+      number whose definition changed, and the cards left unclassified.
+    """
+    cards = CardStore.load(filein)
+    chunks = _card_chunks(cards, jobs)
+    results = _parallel_map(_normalize_chunk, *zip(*chunks, strict=True), jobs=jobs)
+    rows = list(cards.values())
+    expanded, unclassified = 0, []
+    for index, english, pos in itertools.chain.from_iterable(results):
+        if pos is None:
+            unclassified.append(rows[index].to_dict())
+        else:
+            rows[index]["english"] = english
+            expanded += 1
+    if expanded or fileout != filein:
+        dump_json(cards, fileout)
+    return len(cards), expanded, unclassified
+
+
+def normalize(paths, output=None, report=None, jobs=None):
+    """
+    Expand grammar type abbreviations (see matches) in whole vocabulary
+    files without prompting, several files (or the cards of a single large
+    one) in parallel worker processes.
+    Cards whose prefix is missing or unknown are left as they are and
+    collected in the report, so only they need an interactive review.
+
+    Args:
+      paths: Vocabulary JSON files and/or directories of them.
+      output: Output file (for one input file) or directory; by default
+              files are normalized in place.
+      report: Optional JSON file for the unclassified cards (a list of
+              cards, so it can be fed to review and merged back).
+      jobs: Number of worker processes (default: one per core).
+
+    Returns:
+      Dict mapping each input file to its (cards, expanded, unclassified
+      count) tuple.
+    """
+    files = vocab_files(paths)
+    if output is None:
+        targets = files
+    elif len(files) == 1 and not os.path.isdir(output):
+        targets = [output]
+    else:
+        os.makedirs(output, exist_ok=True)
+        targets = [os.path.join(output, os.path.basename(f)) for f in files]
+    with stage("normalize") as info:
+        if len(files) == 1:
+            results = [_normalize_file(files[0], targets[0], jobs)]
+        else:
+            results = _parallel_map(_normalize_file, files, targets, jobs=jobs)
+        info["files"] = len(files)
+        info["cards"] = sum(cards for cards, _, _ in results)
+    if report is not None:
+        dump_json([card for _, _, cards in results for card in cards], report)
+    return {
+        file: (cards, expanded, len(unclassified))
+        for file, (cards, expanded, unclassified) in zip(files, results, strict=True)
+    }
+
+
+LINT_CHECKS = {
+    "missing-field": "error: the card has no chinese or pinyin",
+    "empty-english": "error: the English definition is empty",
+    "no-characters": "error: chinese contains no CJK characters",
+    "invalid-pinyin": "error: pinyin that is not made of valid syllables",
+    "syllable-count": "warning: pinyin syllables do not match the characters",
+    "tone-marks": "warning: numbered or misplaced tone marks (fixable)",
+    "missing-tones": "warning: a word whose syllables are all toneless",
+    "missing-level": "warning: the card has no integer level",
+}
+
+
+def _syllable_count_ok(chinese, syllables):
+    """
+    Whether the pinyin syllables fit the CJK characters one to one,
+    allowing an erhua 儿 written without its r and an r without its 儿.
+    """
+    chars = sum(map(is_cjk, chinese))
+    count = len(syllables)
+    if count == chars:
+        return True
+    erhua = syllables[-1][0] == "r" if syllables else False
+    return (count + 1 == chars and chinese.endswith("儿")) or (
+        count == chars + 1 and erhua
+    )
+
+
+def lint_card(card):
+    """
+    Check one card (see LINT_CHECKS).
+
+    Returns:
+      List of (code, message, fix) tuples, where fix is a {field: value}
+      dict for fixable problems and None otherwise.
+    """
+    problems = []
+    chinese, pinyin = card.get("chinese"), card.get("pinyin")
+    if not isinstance(chinese, str) or not isinstance(pinyin, str):
+        return [("missing-field", "chinese and pinyin are required", None)]
+    english = card.get("english")
+    if not isinstance(english, str) or not english.strip():
+        problems.append(("empty-english", "no English definition", None))
+    if not any(map(is_cjk, chinese)):
+        problems.append(("no-characters", f"no CJK characters in {chinese!r}", None))
+    if type(card.get("level")) is not int:
+        problems.append(("missing-level", f"level is {card.get('level')!r}", None))
+    tokens = _PINYIN_TOKEN.findall(pinyin.lower().replace("u:", "ü"))
+    bad = [token for token in tokens if _segment_pinyin(token) is None]
+    if bad or not tokens:
+        message = f"not pinyin: {' '.join(bad) or repr(pinyin)}"
+        problems.append(("invalid-pinyin", message, None))
+        return problems
+    canonical = numbered_to_marked(pinyin)  # re-marks marked pinyin too
+    if canonical.lower() != " ".join(pinyin.lower().split()):
+        # proper nouns keep their capitals, so only lowercase pinyin is fixed
+        fix = {"pinyin": canonical} if pinyin.islower() else None
+        problems.append(("tone-marks", f"{pinyin!r} should be {canonical!r}", fix))
+    # compare each alternative of 字典/词典 (zìdiǎn/cídiǎn) on its own; later
+    # ones may spell out just the part that differs (日文/日语 rìwén/yǔ)
+    words, readings = chinese.split("/"), pinyin.split("/")
+    if len(words) != len(readings):
+        words, readings = [chinese], [pinyin]
+    for word, reading in zip(words, readings, strict=True):
+        syllables = segment_pinyin(reading) or []
+        shared = len(os.path.commonprefix([word, words[0]]))
+        if word != words[0] and len(syllables) + shared == len(word):
+            continue
+        if not _syllable_count_ok(word, syllables):
+            chars = sum(map(is_cjk, word))
+            problems.append(
+                (
+                    "syllable-count",
+                    f"{len(syllables)} syllables for {chars} characters in {word!r}",
+                    None,
+                )
+            )
+    # single neutral-tone syllables are particles (吗 ma, 的 de)
+    tones = [tone for token in tokens for _, tone in _segment_pinyin(token)]
+    if len(tones) > 1 and all(tone == 5 for tone in tones):
+        problems.append(("missing-tones", f"no tones in {pinyin!r}", None))
+    return problems
+
+
+def _lint_chunk(start, cards):
+    """
+    Lint a chunk of cards (see _card_chunks).
+
+    Returns:
+      (index, problems) pairs of the cards with problems (see lint_card),
+      index counted from start.
+    """
+    return [
+        (index, problems)
+        for index, card in enumerate(cards, start)
+        if (problems := lint_card(card))
+    ]
+
+
+def _lint_file(file, fix=False, jobs=1):
+    """
+    Lint every card of a vocabulary file, its cards split across jobs
+    worker processes, applying the fixes if asked.
+
+    Returns:
+      A (diagnostics, fixed) tuple: diagnostic dicts (see lint) and the
+      number of cards fixed.
+    """
+    cards = CardStore.load(file)
+    chunks = _card_chunks(cards, jobs)
+    results = _parallel_map(_lint_chunk, *zip(*chunks, strict=True), jobs=jobs)
+    rows = list(cards.values())
+    diagnostics, fixed = [], 0
+    for index, problems in itertools.chain.from_iterable(results):
+        card, changed = rows[index], False
+        for code, message, fix_fields in problems:
+            diagnostics.append(
+                {
+                    "file": file,
+                    "index": index,
+                    "chinese": card.get("chinese"),
+                    "code": code,
+                    "severity": LINT_CHECKS[code].partition(":")[0],
+                    "message": message,
+                    "fixed": bool(fix and fix_fields),
+                }
+            )
+            if fix and fix_fields:
+                card.update(fix_fields)
+                changed = True
+        fixed += changed
+    if fixed:
+        dump_json(cards, file)
+    return diagnostics, fixed
+
+
+def lint(paths, fix=False, jobs=None):
+    """
+    Validate the cards of vocabulary files and directories (see
+    LINT_CHECKS), several files (or the cards of a single large one) in
+    parallel worker processes.
+
+    Args:
+      paths: Vocabulary JSON files and/or directories of them.
+      fix: Rewrite fixable problems (tone marks) in place.
+      jobs: Number of worker processes (default: one per core).
+
+    Returns:
+      A (diagnostics, fixed) tuple. Each diagnostic is a dict with file,
+      index (card position), chinese, code, severity, message and whether
+      it was fixed; fixed is the number of cards rewritten.
+    """
+    files = vocab_files(paths)
+    with stage("lint") as info:
+        if len(files) == 1:
+            results = [_lint_file(files[0], fix, jobs)]
+        else:
+            results = _parallel_map(_lint_file, files, [fix] * len(files), jobs=jobs)
+        diagnostics = [d for file_diagnostics, _ in results for d in file_diagnostics]
+        info["files"], info["diagnostics"] = len(files), len(diagnostics)
+    return diagnostics, sum(fixed for _, fixed in results)
+
+
+def journal_path(file):
+    """Append-only edit journal of an interactive session on file, written
+    with append_jsonl and replayed with read_jsonl."""
+    return f"{file}.journal.jsonl"
+
+
+def compact_journal(cards, file, journal):
+    """Atomically write the session's result to file, then drop its journal."""
+    with stage("write"):
+        dump_json(cards, file)
+    if os.path.exists(journal):
+        os.remove(journal)
+
+
+def review(file):
+    """
+    Review vocabulary in a given JSON file and interactively adjust
+    English definitions. Also expands grammatical shorthand if possible.
+
+    Every verdict is appended to an edit journal (journal_path) instead of
+    rewriting the file, so an interrupted session resumes where it
+    stopped. The file itself is rewritten once, when the review finishes.
+    """
+    with stage("load") as info:
+        cards = CardStore.load(file)
+        info["cards"] = len(cards)
+    journal = journal_path(file)
+    with open(file, "rb") as f:
+        base = hashlib.sha1(f.read()).hexdigest()
+    entries, _ = read_jsonl(journal)
+    if entries and entries[0].get("base") != base:
+        print(f"{journal} was made for an older {file}; moved to {journal}.old")
+        os.replace(journal, f"{journal}.old")
+        entries = []
+    if not entries:
+        append_jsonl(journal, {"base": base})
+    for entry in entries:
+        if "card" in entry:
+            cards.card(entry["card"])["english"] = entry["english"]
+    i = entries[-1].get("next", 0) if entries else 0
+    if i:
+        print(f"Resuming at card {i + 1} of {len(cards)} from {journal}.")
+    print("Basic rules:")
+    print(
+        "\tCard details will be shown. You will decide whether to keep the same definition or change the definition."
+    )
+    print(
+        "\tA warning will be shown if the card does not have a known grammar type. The reviewer will generally expand grammar types."
+    )
+    print(
+        "\tEscape codes:\n\t\tenter to keep the same definition. UP followed by a number, e.g., 'UP2' to go back that many cards."
+    )
+    print("\t")
+    while i < len(cards):
+        card = cards.card(i)
+        original = card["english"]
+        english, pos = normalize_pos(card["english"])
+        determine = pos is not None
+        if determine:
+            card["english"] = english
+
+        print(
+            f"Card (l{card['level']}):\n\ten: {card['english']}\n\tpy: {card['pinyin']}\n\tzh: {card['chinese']}"
+        )
+
+        if not determine:
+            print("Unable to determine grammar type.")
+        eng = input("\tverdict: ").strip()
+        if eng == "":
+            card["english"] = card["english"]
+        elif eng.startswith("UP"):
+            i -= int(eng[2:])
+            if i < 0:
+                i = 0
+            append_jsonl(journal, {"next": i})
+            continue
+        else:
+            card["english"] = eng
+        i += 1
+        entry = {"next": i}
+        if card["english"] != original:
+            entry.update(card=i - 1, english=card["english"])
+        append_jsonl(journal, entry)
+    print("All done!")
+    compact_journal(cards, file, journal)
+
+
+def custom(file, lesson=None):
+    """
+    Import custom vocabulary interactively into a JSON file.
+    The user enters vocabulary details. Use numbered pinyin (e.g. ni3hao2);
+    type 'EXIT_PROG' in the English field to terminate import,
+    and 'DEL{N}' (e.g. DEL2) to delete the last N cards. Cards are kept in
+    an edit journal (journal_path) until then, and an interrupted import
+    resumes with them.
+
+    Args:
+      file: Output JSON file for the custom vocabulary.
+      lesson: (Optional) Default lesson number for all entries.
+    """
 
     print("=============== CUSTOM IMPORTS ===============")
     print("\tUse numbered pinyin, e.g. ni3hao2")
@@ -327,7 +2668,15 @@ def custom(file, lesson=None):
     if lesson is not None:
         print(f"\tDefault lesson set: {lesson}")
     print("\t")
+    journal = journal_path(file)
     cards = []
+    for entry in read_jsonl(journal)[0]:
+        if "add" in entry:
+            cards.append(entry["add"])
+        else:
+            cards = cards[: -entry["delete"]]
+    if cards:
+        print(f"Resuming with {len(cards)} cards from {journal}.")
     while True:
         english = input("\tenglish: ").strip()
         if english.upper() == "EXIT_PROG":
@@ -335,8 +2684,9 @@ def custom(file, lesson=None):
         elif english.startswith("DEL") and english[3:].strip().isdigit():
             n = int(english[3:])
             cards = cards[:-n]
+            append_jsonl(journal, {"delete": n})
         else:
-            pinyin = convert_pinyin(input("\tpinyin: ").strip())
+            pinyin = numbered_to_marked(input("\tpinyin: ").strip())
             chinese = input("\tchinese: ").strip()
             thisl = str(lesson)
             if lesson is None:
@@ -357,132 +2707,1500 @@ def custom(file, lesson=None):
             redo = input("Good? Type any key to continue or N/n to restart")
             if redo.lower() == "n":
                 continue
-            cards.append(card)
-    json.dump(cards, open(file, "w"), indent=4, ensure_ascii=False)
+            cards.append(card)
+            append_jsonl(journal, {"add": card})
+    compact_journal(cards, file, journal)
+
+
+def _card_tag(card):
+    """Export tag of a card: its lesson (ic3), or deleted for a tombstone."""
+    return "deleted" if card.get("deleted") else f"ic{card['level']}"
+
+
+def _export_fresh(cards, file, deck):
+    """Fresh Cards text: front-text/back-text/tags blocks."""
+    count = 0
+    with _atomic_open(file) as f:
+        for card in cards:
+            f.write(
+                f"front-text: {card['english']}"
+                f"\nback-text: {card['chinese']} ({card['pinyin']})"
+                f"\ntags: {_card_tag(card)}"
+                "\n\n"
+            )
+            count += 1
+    return count
+
+
+def _delimited_rows(cards):
+    for card in cards:
+        yield (
+            card["english"],
+            card["chinese"],
+            card["pinyin"],
+            _card_tag(card),
+        )
+
+
+def _export_tsv(cards, file, deck):
+    """Anki-importable TSV (english, chinese, pinyin, tags)."""
+    count = 0
+    with _atomic_open(file) as f:
+        f.write(f"#separator:tab\n#html:false\n#deck:{deck}\n#tags column:4\n")
+        for row in _delimited_rows(cards):
+            fields = (" ".join(field.split()) for field in row)
+            f.write("\t".join(fields) + "\n")
+            count += 1
+    return count
+
+
+def _export_csv(cards, file, deck):
+    """Anki-importable CSV (english, chinese, pinyin, tags)."""
+    count = 0
+    with _atomic_open(file, newline="") as f:
+        f.write(f"#separator:comma\n#html:false\n#deck:{deck}\n#tags column:4\n")
+        writer = csv.writer(f, lineterminator="\n")
+        for row in _delimited_rows(cards):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _export_pleco(cards, file, deck):
+    """
+    Pleco XML flashcards, one 'ic lesson N' category per level (readable by
+    add-xml). Pleco lists categories before cards, so cards are spooled to
+    a temporary file while the (small) set of levels is collected.
+    """
+    levels = []
+    count = 0
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        for card in cards:
+            category = _card_tag(card)
+            if not card.get("deleted"):
+                category = f"ic lesson {card['level']}"
+            if category not in levels:
+                levels.append(category)
+            spool.write(
+                '<card language="chinese"><entry>'
+                f'<headword charset="sc">{escape(card["chinese"])}</headword>'
+                f'<pron type="hypy" tones="marks">{escape(card["pinyin"])}</pron>'
+                f"<defn>{escape(card['english'])}</defn></entry>"
+                f"<catassign category={quoteattr(category)}/></card>\n"
+            )
+            count += 1
+        spool.seek(0)
+        with _atomic_open(file) as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<plecoflash formatversion="2">\n<categories>\n')
+            for category in levels:
+                f.write(f"<category name={quoteattr(category)}/>\n")
+            f.write("</categories>\n<cards>\n")
+            while chunk := spool.read(1 << 16):
+                f.write(chunk)
+            f.write("</cards>\n</plecoflash>\n")
+    return count
+
+
+ANKI_SCHEMA = """
+CREATE TABLE col (id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null);
+CREATE TABLE notes (id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null);
+CREATE TABLE cards (id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null);
+CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+
+def _anki_collection(conn, deck, now):
+    """Fill the col row of a fresh Anki (schema 11) collection."""
+    model_id, deck_id = now * 1000, now * 1000 + 1
+    model = {
+        "id": model_id,
+        "name": "Chinese (english/chinese)",
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [
+            {
+                "name": "Card 1",
+                "ord": 0,
+                "qfmt": "{{Front}}",
+                "afmt": "{{FrontSide}}<hr id=answer>{{Back}}",
+                "did": None,
+                "bqfmt": "",
+                "bafmt": "",
+            }
+        ],
+        "flds": [
+            {
+                "name": name,
+                "ord": i,
+                "sticky": False,
+                "rtl": False,
+                "font": "Arial",
+                "size": 20,
+                "media": [],
+            }
+            for i, name in enumerate(("Front", "Back"))
+        ],
+        "css": ".card { font-family: arial; font-size: 20px; text-align: center; }",
+        "latexPre": "\\documentclass[12pt]{article}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "latexsvg": False,
+        "req": [[0, "any", [0]]],
+        "tags": [],
+        "vers": [],
+    }
+
+    def deck_entry(did, name):
+        return {
+            "id": did,
+            "name": name,
+            "mod": now,
+            "usn": -1,
+            "lrnToday": [0, 0],
+            "revToday": [0, 0],
+            "newToday": [0, 0],
+            "timeToday": [0, 0],
+            "collapsed": False,
+            "browserCollapsed": False,
+            "desc": "",
+            "dyn": 0,
+            "conf": 1,
+            "extendNew": 0,
+            "extendRev": 0,
+        }
+
+    decks = {"1": deck_entry(1, "Default"), str(deck_id): deck_entry(deck_id, deck)}
+    dconf = {
+        "1": {
+            "id": 1,
+            "name": "Default",
+            "mod": 0,
+            "usn": 0,
+            "maxTaken": 60,
+            "autoplay": True,
+            "timer": 0,
+            "replayq": True,
+            "dyn": False,
+            "new": {
+                "delays": [1, 10],
+                "ints": [1, 4, 7],
+                "initialFactor": 2500,
+                "order": 1,
+                "perDay": 20,
+                "bury": False,
+            },
+            "lapse": {
+                "delays": [10],
+                "mult": 0,
+                "minInt": 1,
+                "leechFails": 8,
+                "leechAction": 0,
+            },
+            "rev": {
+                "perDay": 200,
+                "ease4": 1.3,
+                "maxIvl": 36500,
+                "hardFactor": 1.2,
+                "bury": False,
+            },
+        }
+    }
+    conf = {
+        "nextPos": 1,
+        "estTimes": True,
+        "activeDecks": [1],
+        "sortType": "noteFld",
+        "timeLim": 0,
+        "sortBackwards": False,
+        "addToCur": True,
+        "curDeck": 1,
+        "newSpread": 0,
+        "dueCounts": True,
+        "curModel": model_id,
+        "collapseTime": 1200,
+    }
+    conn.execute(
+        "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+        (
+            now,
+            now * 1000,
+            now * 1000,
+            json.dumps(conf),
+            json.dumps({str(model_id): model}),
+            json.dumps(decks),
+            json.dumps(dconf),
+        ),
+    )
+    return model_id, deck_id
+
+
+def _export_apkg(cards, file, deck):
+    """
+    Native Anki package: a schema 11 collection built with sqlite3 in a
+    temporary file (notes inserted in batches as cards stream in), zipped
+    with an empty media map.
+    """
+    now = int(time.time())
+    count = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "collection.anki2")
+        conn = sqlite3.connect(path)
+        conn.executescript(ANKI_SCHEMA)
+        model_id, deck_id = _anki_collection(conn, deck, now)
+        base = now * 1000
+        batch = []
+
+        def flush():
+            conn.executemany(
+                "INSERT INTO notes VALUES (?, ?, ?, ?, -1, ?, ?, ?, ?, 0, '')",
+                [note for note, _ in batch],
+            )
+            conn.executemany(
+                "INSERT INTO cards VALUES "
+                "(?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+                [card for _, card in batch],
+            )
+            batch.clear()
+
+        for card in cards:
+            front = html.escape(card["english"])
+            back = html.escape(f"{card['chinese']} ({card['pinyin']})")
+            guid = hashlib.sha1(card["chinese"].encode()).hexdigest()[:10]
+            csum = int(hashlib.sha1(front.encode()).hexdigest()[:8], 16)
+            note_id = base + count
+            fields = f"{front}\x1f{back}"
+            tags = f" {_card_tag(card)} "
+            note = (note_id, guid, model_id, now, tags, fields, front, csum)
+            batch.append((note, (note_id, note_id, deck_id, now, count + 1)))
+            count += 1
+            if len(batch) >= 1000:
+                flush()
+        flush()
+        conn.commit()
+        conn.close()
+        with (
+            _atomic_open(file, "wb") as f,
+            zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as package,
+        ):
+            package.write(path, "collection.anki2")
+            package.writestr("media", "{}")
+    return count
+
+
+EXPORT_FORMATS = {
+    "fresh": _export_fresh,
+    "tsv": _export_tsv,
+    "csv": _export_csv,
+    "pleco": _export_pleco,
+    "apkg": _export_apkg,
+}
+EXPORT_EXTENSIONS = {".tsv": "tsv", ".csv": "csv", ".xml": "pleco", ".apkg": "apkg"}
+
+
+def export_cards(cards, file, fmt="fresh", deck="Chinese"):
+    """
+    Stream cards to file in one of EXPORT_FORMATS. Cards are written as they
+    are read, so memory does not grow with the size of the deck.
+
+    Args:
+      cards: Iterable of cards.
+      file: Output file.
+      fmt: Export format (fresh, tsv, csv, pleco or apkg).
+      deck: Deck name (used by the Anki formats).
+
+    Returns:
+      Number of cards written.
+    """
+    with stage(f"export-{fmt}") as info:
+        info["cards"] = EXPORT_FORMATS[fmt](cards, file, deck)
+    return info["cards"]
+
+
+_FILTER_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<paren>[()])
+      | level\s*(?P<op><=|>=|!=|==|=|<|>)\s*(?P<number>-?\d+)
+      | (?P<field>\w+):(?:"(?P<quoted>[^"]*)"|(?P<value>[^\s()]+))
+      | (?P<word>and|or|not)\b
+    )""",
+    re.VERBOSE,
+)
+_FILTER_OPS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "=": lambda a, b: a == b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+
+class CardFilter:
+    """
+    A filter expression compiled into a card predicate, e.g.
+
+      level>=3 and level<=5 and pos:verb and not tag:proper
+
+    Terms are level comparisons (<, <=, >, >=, =, !=; cards without a usable
+    level never match), pos:TYPE (the card's grammar types include TYPE,
+    abbreviated or not, e.g. pos:v or pos:"verb + object"), tag:TAG (TAG is
+    in the card's optional "tags" list) and FIELD:TEXT (case-insensitive
+    substring of any other field, e.g. english:water). Terms combine with
+    and, or, not and parentheses.
+
+    The level bounds and part of speech that every match must have are kept
+    as bounds, so stores can narrow the candidates with their indexes
+    (store_cards, CardStore.rows) before the predicate runs.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._tokens = []
+        pos = 0
+        while expression[pos:].strip():
+            match = _FILTER_TOKEN.match(expression, pos)
+            if match is None:
+                raise ValueError(f"invalid filter at {expression[pos:].strip()!r}")
+            self._tokens.append(match)
+            pos = match.end()
+        self._next = 0
+        self._test, bounds = self._parse_or()
+        if self._next < len(self._tokens):
+            raise ValueError(f"unexpected {self._tokens[self._next].group().strip()!r}")
+        self.bounds = {}
+        for key, value in bounds:
+            if key == "min_level":
+                self.bounds[key] = max(value, self.bounds.get(key, value))
+            elif key == "max_level":
+                self.bounds[key] = min(value, self.bounds.get(key, value))
+            else:
+                # one part of speech narrows enough; the predicate checks all
+                self.bounds.setdefault(key, value)
+
+    def __call__(self, card):
+        return self._test(card)
+
+    def __repr__(self):
+        return f"CardFilter({self.expression!r})"
+
+    # recursive descent; each rule returns (predicate, bounds implied by it)
+
+    def _peek(self, group):
+        if self._next < len(self._tokens):
+            return self._tokens[self._next].group(group)
+        return None
+
+    def _parse_or(self):
+        terms = [self._parse_and()]
+        while self._peek("word") == "or":
+            self._next += 1
+            terms.append(self._parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        tests = [test for test, _ in terms]
+        return (lambda card: any(test(card) for test in tests)), []
+
+    def _parse_and(self):
+        terms = [self._parse_not()]
+        while self._peek("word") == "and":
+            self._next += 1
+            terms.append(self._parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        tests = [test for test, _ in terms]
+        bounds = [bound for _, term_bounds in terms for bound in term_bounds]
+        return (lambda card: all(test(card) for test in tests)), bounds
+
+    def _parse_not(self):
+        if self._peek("word") == "not":
+            self._next += 1
+            test, _ = self._parse_not()
+            return (lambda card: not test(card)), []
+        return self._parse_term()
+
+    def _parse_term(self):
+        if self._next >= len(self._tokens):
+            raise ValueError(f"incomplete filter: {self.expression!r}")
+        token = self._tokens[self._next]
+        self._next += 1
+        if token["paren"] == "(":
+            term = self._parse_or()
+            if self._peek("paren") != ")":
+                raise ValueError(f"missing ) in filter: {self.expression!r}")
+            self._next += 1
+            return term
+        if token["op"] is not None:
+            op, number = _FILTER_OPS[token["op"]], int(token["number"])
+
+            def test(card):
+                level = _card_level(card)
+                return level != math.inf and op(level, number)
+
+            bounds = {
+                "<": [("max_level", number - 1)],
+                "<=": [("max_level", number)],
+                ">": [("min_level", number + 1)],
+                ">=": [("min_level", number)],
+                "=": [("min_level", number), ("max_level", number)],
+                "==": [("min_level", number), ("max_level", number)],
+                "!=": [],
+            }[token["op"]]
+            return test, bounds
+        if token["field"] is not None:
+            field = token["field"]
+            value = token["quoted"] if token["quoted"] is not None else token["value"]
+            if field == "pos":
+                pos = matches.get(value, value)
+
+                def test(card):
+                    card_pos = getattr(card, "pos", None)
+                    if card_pos is None:
+                        card_pos = _card_pos(card.get("english", ""))
+                    return pos in card_pos.split(", ")
+
+                return test, [("pos", pos)]
+            if field == "tag":
+
+                def test(card):
+                    tags = card.get("tags", ())
+                    return value in (tags.split() if isinstance(tags, str) else tags)
+
+                return test, []
+            text = value.lower()
+            return (lambda card: text in str(card.get(field, "")).lower()), []
+        raise ValueError(f"unexpected {token.group().strip()!r} in filter")
+
+
+def _snapshot_cards(snapshot, rows):
+    with snapshot:
+        yield from map(snapshot._card, rows)
+
+
+def _truth_cards(accept=None, conn=None):
+    """
+    The ground truth cards accept lets through (all of them for None), from
+    the SQLite store conn, else the snapshot of truth.json if it is current
+    (see write_snapshot), else truth.json itself. For a CardFilter, its
+    level and part-of-speech bounds are answered from the store indexes
+    first, so only candidate cards are tested. The store and the snapshot
+    keep their indexes on disk, and a snapshot decodes only the candidates.
+    truth.json is read once per call, so its cards are parsed as plain
+    dicts and all tested: indexing them would cost more than the filter.
+    """
+    bounds = accept.bounds if isinstance(accept, CardFilter) else {}
+    if conn is not None:
+        cards = store_cards(conn, **bounds)
+    elif (snapshot := current_snapshot("truth.json")) is not None:
+        levels = {
+            key: bounds[key] for key in ("min_level", "max_level") if key in bounds
+        }
+        with stage("select") as info:
+            rows = snapshot.rows(**levels)
+            info["candidates"] = len(rows)
+        cards = _snapshot_cards(snapshot, rows)
+    else:
+        cards = load_cards("truth.json")
+    return cards if accept is None else filter(accept, cards)
+
+
+def truth_to_card(file, accept=None, db=None, fmt=None, deck="Chinese"):
+    """
+    Export the ground truth JSON (truth.json) to a file for use with Fresh
+    Cards, Anki or Pleco.
+
+    Args:
+      file: Output file.
+      accept: Optional function for filtering cards (default accepts all
+              cards), e.g. a CardFilter, whose level and part-of-speech
+              bounds are answered from indexes (see _truth_cards).
+      db: Optional SQLite store to export from instead of truth.json.
+      fmt: Export format (see EXPORT_FORMATS); by default it is guessed from
+           the file extension, falling back to Fresh Cards text.
+      deck: Deck name for the Anki formats.
+
+    Returns:
+      Number of cards exported.
+    """
+    if fmt is None:
+        fmt = EXPORT_EXTENSIONS.get(os.path.splitext(file)[1].lower(), "fresh")
+    if db is not None:
+        conn = open_store(db)
+        try:
+            return export_cards(_truth_cards(accept, conn), file, fmt, deck)
+        finally:
+            conn.close()
+    return export_cards(_truth_cards(accept), file, fmt, deck)
+
+
+def _card_hash(card):
+    return hashlib.sha1(
+        json.dumps(dict(card), sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+def export_delta(
+    file,
+    accept=None,
+    db=None,
+    fmt=None,
+    deck="Chinese",
+    delta_file=None,
+    report_file=None,
+):
+    """
+    Incremental truth_to_card. A manifest of content hashes per Chinese key
+    records what the last export contained; cards are compared against it
+    to find what was added, changed or removed.
+
+    Without delta_file, file is rewritten in place, but only if something
+    changed (or the format did), and its manifest is file + '.manifest.json'.
+    With delta_file, only the changes are written there and file itself is
+    left alone: the added and changed cards, plus a tombstone for each
+    removed one (a card with just the Chinese key and "deleted": true,
+    exported with the tag deleted). Deltas keep their own manifest,
+    file + '.delta.manifest.json', of what the delta stream has shipped
+    (starting from the full export's), so full and delta exports never
+    hide changes from each other. A manifest is updated after its export
+    succeeds.
+
+    Args:
+      file: Export file the manifest belongs to.
+      accept, db, deck: As for truth_to_card.
+      fmt: Format of whatever is written (delta_file if given, else file);
+           by default guessed from that file's extension.
+      delta_file: Optional file for only the changes since the last delta.
+      report_file: Optional JSON file for the lists of changed keys.
+
+    Returns:
+      A report dict with added, changed and removed Chinese keys.
+    """
+    if fmt is None:
+        target = file if delta_file is None else delta_file
+        fmt = EXPORT_EXTENSIONS.get(os.path.splitext(target)[1].lower(), "fresh")
+    full_manifest = manifest_path = f"{file}.manifest.json"
+    if delta_file is not None:
+        manifest_path = f"{file}.delta.manifest.json"
+    manifest = {"format": None, "cards": {}}
+    for path in dict.fromkeys([manifest_path, full_manifest]):
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            break
+    previous = manifest["cards"]
+    conn = None if db is None else open_store(db)
+    cards = _truth_cards(accept, conn)
+
+    hashes = {}
+    report = {"added": [], "changed": [], "removed": []}
+    pending = []
+    # a full export rewrites file from the same cards, so keep them all
+    selected = [] if delta_file is None else None
+    for card in cards:
+        if selected is not None:
+            selected.append(card)
+        key = card["chinese"]
+        digest = hashes[key] = _card_hash(card)
+        if key not in previous:
+            report["added"].append(key)
+        elif previous[key] != digest:
+            report["changed"].append(key)
+        else:
+            continue
+        pending.append(card)
+    if conn is not None:
+        conn.close()
+    report["removed"] = [key for key in previous if key not in hashes]
+
+    if delta_file is not None:
+        tombstones = [
+            {"english": "", "chinese": key, "pinyin": "", "deleted": True}
+            for key in report["removed"]
+        ]
+        export_cards(pending + tombstones, delta_file, fmt, deck)
+    elif (
+        pending
+        or report["removed"]
+        or manifest["format"] != fmt
+        or not os.path.exists(file)
+    ):
+        export_cards(selected, file, fmt, deck)
+        manifest["format"] = fmt
+    manifest["cards"] = hashes
+    dump_json(manifest, manifest_path)
+    if report_file is not None:
+        dump_json(report, report_file)
+    return report
+
+
+class VocabTableParser(HTMLParser):
+    """
+    Incremental parser for HTML vocabulary tables: every row with exactly
+    three data cells (chinese, pinyin, english) becomes a card. Header rows
+    made of <th> cells are skipped, and cell text may contain anything,
+    including '|'.
+    """
+
+    def __init__(self, level):
+        super().__init__()
+        self.level = level
+        self.cards = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+            self._row.append((tag, self._cell))
+        elif tag == "br" and self._cell is not None:
+            self._cell.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th"):
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            cells = [" ".join("".join(text).split()) for _, text in self._row]
+            if len(cells) == 3 and all(tag == "td" for tag, _ in self._row):
+                self.cards.append(
+                    {
+                        "chinese": cells[0],
+                        "pinyin": cells[1],
+                        "english": cells[2],
+                        "level": self.level,
+                    }
+                )
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_vocab_table(filein, level):
+    """
+    Parse the vocabulary table(s) of one HTML file, reading it in chunks.
+
+    Returns:
+      List of cards, all with the given level.
+    """
+    parser = VocabTableParser(level)
+    with open(filein, encoding="utf-8", errors="replace") as f:
+        while chunk := f.read(1 << 16):
+            parser.feed(chunk)
+    parser.close()
+    return parser.cards
+
+
+def load_xml(filein, fileout, level, jobs=None):
+    """
+    Load vocabulary from HTML tables (assumed to be in a specific format)
+    in the given input file(s) and save it as a JSON file with the given level.
+    Several files are parsed in parallel worker processes.
+
+    Args:
+       filein: Input HTML file, or a list of files and/or (file, level) pairs
+               to give a file its own level.
+       fileout: Output JSON file.
+       level: Lesson/level number (int) to assign to all imported cards.
+       jobs: Number of worker processes (default: one per core).
+
+    Returns:
+       Number of cards written.
+    """
+    files = [filein] if isinstance(filein, str) else filein
+    files = [(f, level) if isinstance(f, str) else tuple(f) for f in files]
+    with stage("parse") as info:
+        results = _parallel_map(parse_vocab_table, *zip(*files, strict=True), jobs=jobs)
+        cards = [card for result in results for card in result]
+        info["files"], info["cards"] = len(files), len(cards)
+    with stage("write"):
+        dump_json(cards, fileout)
+    return len(cards)
+
+
+def load_cards(file):
+    """
+    Load the cards of a vocabulary file, whether it is a list of cards or a
+    truth.json-style dict keyed by chinese.
+    """
+    with open(file, encoding="utf-8") as f:
+        data = json.load(f)
+    return list(data.values()) if isinstance(data, dict) else data
+
+
+def is_cjk(char):
+    """Whether a character is a CJK unified (or compatibility) ideograph."""
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF
+        or 0x3400 <= code <= 0x4DBF
+        or 0xF900 <= code <= 0xFAFF
+        or 0x20000 <= code <= 0x2FA1F
+    )
+
+
+SEARCH_INDEX = ".search_index.sqlite"
+
+
+def _ngrams(text, n):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def _search_tokens(card):
+    """Index terms of a card: English words, toneless and numbered pinyin
+    syllables, Chinese characters, and n-grams for partial matches."""
+    tokens = set()
+    for word in re.findall(r"\w+", card.get("english", "").lower()):
+        if not any(is_cjk(char) for char in word):
+            tokens.add(f"en:{word}")
+            tokens.update(f"ng:{gram}" for gram in _ngrams(word, 3))
+    for syllable, tone in segment_pinyin(card.get("pinyin", "")) or ():
+        tokens.add(f"py:{syllable}")
+        tokens.add(f"pt:{syllable}{tone}")
+    toneless = toneless_pinyin(card.get("pinyin", ""))
+    for word in re.findall(r"[a-zü]+", toneless):
+        tokens.add(f"py:{word}")
+        tokens.update(f"ng:{gram}" for gram in _ngrams(word, 3))
+    chinese = "".join(filter(is_cjk, card.get("chinese", "")))
+    tokens.update(f"zh:{char}" for char in chinese)
+    tokens.update(f"ng:{gram}" for gram in _ngrams(chinese, 2))
+    return tokens
+
+
+def _open_search_index(index):
+    conn = sqlite3.connect(index)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS docs (
+            id INTEGER PRIMARY KEY, source TEXT NOT NULL, card TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS docs_source ON docs (source);
+        CREATE TABLE IF NOT EXISTS postings (
+            token TEXT NOT NULL, doc INTEGER NOT NULL, PRIMARY KEY (token, doc)
+        ) WITHOUT ROWID;
+        """
+    )
+    return conn
+
+
+def update_search_index(sources=None, index=SEARCH_INDEX):
+    """
+    Bring the on-disk inverted index up to date. Only sources whose mtime or
+    size changed are re-indexed; sources that disappeared are dropped.
+
+    Args:
+      sources: Vocabulary files to index (default: truth.json and user/*.json).
+      index: SQLite file holding the index.
+
+    Returns:
+      List of the source files that were (re)indexed.
+    """
+    if sources is None:
+        sources = ["truth.json", *sorted(glob.glob(os.path.join("user", "*.json")))]
+    sources = [path for path in sources if os.path.exists(path)]
+    conn = _open_search_index(index)
+    rows = conn.execute("SELECT path, mtime, size FROM sources")
+    known = {path: (mtime, size) for path, mtime, size in rows}
+    changed = []
+    with conn:
+        for path in set(known) - set(sources):
+            _drop_search_source(conn, path)
+        for path in sources:
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            _drop_search_source(conn, path)
+            for card in load_cards(path):
+                doc = conn.execute(
+                    "INSERT INTO docs (source, card) VALUES (?, ?)",
+                    (path, json.dumps(card, ensure_ascii=False)),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT OR IGNORE INTO postings VALUES (?, ?)",
+                    ((token, doc) for token in _search_tokens(card)),
+                )
+            conn.execute(
+                "INSERT INTO sources VALUES (?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size),
+            )
+            changed.append(path)
+    conn.close()
+    return changed
+
+
+def _drop_search_source(conn, path):
+    conn.execute(
+        "DELETE FROM postings WHERE doc IN (SELECT id FROM docs WHERE source = ?)",
+        (path,),
+    )
+    conn.execute("DELETE FROM docs WHERE source = ?", (path,))
+    conn.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+
+def _sqlite_postings(conn):
+    """Posting lookup (token -> doc ids) on the on-disk search index."""
+
+    def lookup(token):
+        rows = conn.execute("SELECT doc FROM postings WHERE token = ?", (token,))
+        return {doc for (doc,) in rows}
+
+    return lookup
+
+
+def _postings(lookup, tokens):
+    """Doc ids containing all of the given tokens (None for no tokens)."""
+    result = None
+    for token in tokens:
+        docs = set(lookup(token))
+        result = docs if result is None else result & docs
+        if not result:
+            return set()
+    return result
+
+
+def _term_docs(lookup, term):
+    """Doc ids matching one query term, exactly or as a partial match."""
+    if any(is_cjk(char) for char in term):
+        chars = "".join(filter(is_cjk, term))
+        grams = _ngrams(chars, 2) or {chars}
+        kind = "ng" if len(chars) > 1 else "zh"
+        return _postings(lookup, {f"{kind}:{gram}" for gram in grams}), chars
+    docs = _postings(lookup, {f"en:{term}"})
+    syllables = segment_pinyin(term)
+    if syllables:
+        if term != toneless_pinyin(term):
+            tokens = {f"pt:{syllable}{tone}" for syllable, tone in syllables}
+        else:
+            tokens = {f"py:{syllable}" for syllable, _ in syllables}
+        docs |= _postings(lookup, tokens) or set()
+    if not docs and len(term) >= 3:
+        docs = _postings(lookup, {f"ng:{gram}" for gram in _ngrams(term, 3)})
+    return docs, None
+
+
+def _query_docs(lookup, query):
+    """
+    Doc ids matching every term of a search query, and the Chinese
+    substrings the matching cards must contain.
+    """
+    docs, substrings = None, []
+    for term in query.lower().replace("u:", "ü").split():
+        term_docs, chars = _term_docs(lookup, term)
+        docs = term_docs if docs is None else docs & term_docs
+        if chars:
+            substrings.append(chars)
+    return docs or set(), substrings
+
+
+def search(query, limit=20, index=SEARCH_INDEX, sources=None):
+    """
+    Look cards up by English words, pinyin (toned, numbered or toneless) or
+    Chinese characters, including partial words and substrings. All terms
+    of the query must match.
+
+    Args:
+      query: Search string, e.g. 'teacher', 'lao3shi1', 'laoshi', '老'.
+      limit: Maximum number of results.
+      index: SQLite file holding the index (updated first if stale).
+      sources: Vocabulary files to index (see update_search_index).
+
+    Returns:
+      List of (source, card) tuples.
+    """
+    with stage("index") as info:
+        info["reindexed"] = len(update_search_index(sources, index))
+    conn = _open_search_index(index)
+    docs, substrings = _query_docs(_sqlite_postings(conn), query)
+    results = []
+    for doc in sorted(docs):
+        source, card = conn.execute(
+            "SELECT source, card FROM docs WHERE id = ?", (doc,)
+        ).fetchone()
+        card = json.loads(card)
+        if all(chars in card.get("chinese", "") for chars in substrings):
+            results.append((source, card))
+            if len(results) >= limit:
+                break
+    conn.close()
+    return results
+
+
+def headword_levels(file="truth.json"):
+    """
+    Headwords of a deck with their lowest level. Alternatives written as
+    字典/词典 count as separate headwords; cards without a level get
+    math.inf.
+    """
+    with open(file, encoding="utf-8") as f:
+        deck = json.load(f)
+    levels = {}
+    for key, card in deck.items():
+        for form in key.split("/"):
+            word = "".join(filter(is_cjk, form))
+            if word:
+                levels[word] = min(levels.get(word, math.inf), _card_level(card))
+    return levels
+
+
+class MaxMatcher:
+    """
+    Forward maximum matching over a set of headwords: at every position the
+    longest headword starting there is taken, otherwise one character.
+    The trie is kept flat as the set of all word prefixes, so each step is
+    a few hash lookups and a text is segmented in time linear in its
+    length (times the longest headword).
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.prefixes = {word[:i] for word in levels for i in range(1, len(word))}
+        self.longest = max(map(len, levels), default=1)
+
+    def match(self, text, i):
+        """Length of the longest headword at text[i:], or 0."""
+        best, end = 0, min(len(text), i + self.longest)
+        for j in range(i + 1, end + 1):
+            piece = text[i:j]
+            if piece in self.levels:
+                best = j - i
+            elif piece not in self.prefixes:
+                break
+        return best
+
+    def scan(self, chunks):
+        """
+        Segment a stream of text chunks. Only CJK characters are matched;
+        anything else ends a word.
+
+        Yields:
+          (segment, level) pairs, with level None for an unknown character,
+          and a single (None, None) for each stretch of other text between
+          them (punctuation, spaces, newlines).
+        """
+        buffer = ""
+        gap = True  # nothing to separate before the first segment
+        for chunk in itertools.chain(chunks, [None]):
+            final = chunk is None
+            buffer += chunk or ""
+            i = 0
+            # keep enough lookahead that no match is cut at a chunk boundary
+            while i < len(buffer) and (final or i + self.longest <= len(buffer)):
+                if not is_cjk(buffer[i]):
+                    if not gap:
+                        yield None, None
+                        gap = True
+                    i += 1
+                    continue
+                gap = False
+                n = self.match(buffer, i)
+                if n:
+                    word = buffer[i : i + n]
+                    yield word, self.levels[word]
+                    i += n
+                else:
+                    yield buffer[i], None
+                    i += 1
+            buffer = buffer[i:]
+
+
+_matcher = None  # MaxMatcher of the coverage worker processes
+
+
+def _init_coverage(levels):
+    global _matcher
+    _matcher = MaxMatcher(levels)
+
+
+def _file_coverage(file):
+    """
+    Coverage counts of one text file: CJK characters per headword level
+    (None for unknown), known word frequencies and unknown segments (runs
+    of characters no headword covers, ended by a known word or by any
+    non-CJK character).
+    """
+    chars, words, unknown = (
+        collections.Counter(),
+        collections.Counter(),
+        collections.Counter(),
+    )
+    run = []
+    with open(file, encoding="utf-8", errors="replace") as f:
+        chunks = iter(lambda: f.read(1 << 16), "")
+        for segment, level in _matcher.scan(chunks):
+            if segment is not None and level is None:
+                chars[None] += 1
+                run.append(segment)
+                continue
+            if run:
+                unknown["".join(run)] += 1
+                run = []
+            if segment is not None:
+                chars[level] += len(segment)
+                words[segment] += 1
+    if run:
+        unknown["".join(run)] += 1
+    return chars, words, unknown
 
 
-def truth_to_card(file, accept=lambda card: True):
+def coverage(paths, truth="truth.json", jobs=None):
     """
-    Export the ground truth JSON (truth.json) to a text file in a format
-    compatible with Fresh Cards / Anki.
+    Measure how much of a corpus the deck's vocabulary covers. Text is
+    segmented by forward maximum matching against the truth headwords
+    (MaxMatcher), streaming each file in chunks; several files are scanned
+    in parallel worker processes.
 
     Args:
-      file: Output text file.
-      accept: Optional function for filtering cards (default accepts all cards).
+      paths: Text files and/or directories of them.
+      truth: Ground truth JSON file with the known vocabulary.
+      jobs: Number of worker processes (default: one per core).
+
+    Returns:
+      A report dict: total and known CJK characters, overall coverage,
+      cumulative coverage by level (words up to that level), per-file
+      coverage, and Counters of known words and unknown segments.
     """
-    cards = filter(lambda a: accept(a[1]), json.load(open("truth.json")).items())
-    out = ""
-    for item in cards:
-        card = item[1]
-        out += f"front-text: {card['english']}"
-        out += f"\nback-text: {card['chinese']} ({card['pinyin']})"
-        out += f"\ntags: ic{card['level']}"
-        out += "\n\n"
-    # dump to file
-    with open(file, "w") as f:
-        f.write(out)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+    levels = headword_levels(truth)
+    with stage("scan") as info:
+        results = _parallel_map(
+            _file_coverage,
+            files,
+            jobs=jobs,
+            initializer=_init_coverage,
+            initargs=(levels,),
+        )
+        info["files"] = len(files)
+    chars, words, unknown = (
+        collections.Counter(),
+        collections.Counter(),
+        collections.Counter(),
+    )
+    per_file = {}
+    for file, (file_chars, file_words, file_unknown) in zip(
+        files, results, strict=True
+    ):
+        chars.update(file_chars)
+        words.update(file_words)
+        unknown.update(file_unknown)
+        total = sum(file_chars.values())
+        per_file[file] = (total - file_chars[None]) / total if total else None
+    total = sum(chars.values())
+    known = total - chars[None]
+    by_level, cumulative = {}, 0
+    for level in sorted(level for level in chars if level is not None):
+        cumulative += chars[level]
+        by_level["unleveled" if level == math.inf else level] = cumulative / total
+    return {
+        "characters": total,
+        "known": known,
+        "coverage": known / total if total else None,
+        "by_level": by_level,
+        "files": per_file,
+        "words": words,
+        "unknown": unknown,
+    }
+
+
+def review_log_path(file="truth.json", learner=None):
+    """Append-only review log kept next to the deck, one per learner."""
+    stem = os.path.splitext(file)[0]
+    return f"{stem}.{learner}.reviews.jsonl" if learner else f"{stem}.reviews.jsonl"
+
+
+def schedule_path(log):
+    """Compacted schedule snapshot of a review log (see load_schedule)."""
+    return f"{os.path.splitext(log)[0]}.schedule.json"
 
 
-def load_xml(filein, fileout, level):
+def sm2(state, grade, now):
     """
-    Load vocabulary from an HTML table (assumed to be in a specific format)
-    in the given input file and save it as a JSON file with the given level.
+    Apply one SM-2 review to a card's scheduling state.
 
     Args:
-       filein: Input HTML file.
-       fileout: Output JSON file.
-       level: Lesson/level number (int) to assign to all imported cards.
+      state: Dict with reps, interval (days), ease and due (epoch seconds),
+             or None for a new card.
+      grade: Recall quality from 0 (blackout) to 5 (perfect).
+      now: Review time (epoch seconds).
+
+    Returns:
+      The new state dict.
     """
+    state = dict(state or {"reps": 0, "interval": 0, "ease": 2.5, "due": 0})
+    if grade < 3:
+        state["reps"], state["interval"] = 0, 1
+    else:
+        if state["reps"] == 0:
+            state["interval"] = 1
+        elif state["reps"] == 1:
+            state["interval"] = 6
+        else:
+            state["interval"] = round(state["interval"] * state["ease"])
+        state["reps"] += 1
+    state["ease"] = max(
+        1.3, state["ease"] + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02)
+    )
+    state["due"] = now + state["interval"] * 86400
+    return state
 
-    def run_command(command):  # WARNING: AI-generated code, use with caution
-        """
-        Runs a shell command and returns its output as a string.
 
-        Args:
-            command: The command to execute as a string.
+def load_schedule(log):
+    """
+    Per-card scheduling state of a review log: the compacted snapshot
+    (schedule_path) plus a replay of only the reviews logged after it. The
+    snapshot is then brought up to date, so each review is replayed once.
+
+    Returns:
+      Dict mapping chinese to its SM-2 state.
+    """
+    states, offset, head = {}, 0, ""
+    if os.path.exists(log):
+        with open(log, encoding="utf-8", errors="replace") as f:
+            head = f.readline()
+    snapshot = schedule_path(log)
+    if os.path.exists(snapshot):
+        with open(snapshot, encoding="utf-8") as f:
+            saved = json.load(f)
+        # a log that was replaced since has to be replayed in full
+        if saved["head"] == head and saved["offset"] <= os.path.getsize(log):
+            states, offset = saved["states"], saved["offset"]
+    entries, end = read_jsonl(log, offset)
+    for entry in entries:
+        key = entry["chinese"]
+        states[key] = sm2(states.get(key), entry["grade"], entry["time"])
+    if end != offset:
+        with _atomic_open(snapshot) as f:
+            saved = {"offset": end, "head": head, "states": states}
+            json.dump(saved, f, ensure_ascii=False)
+    return states
+
+
+def record_review(log, chinese, grade, now):
+    """Append one review to the log and make sure it reached the disk."""
+    append_jsonl(log, {"chinese": chinese, "grade": grade, "time": now})
+
+
+def due_queue(keys, states):
+    """
+    Build the due queue: a heap of (due, position, chinese). New cards are
+    due immediately, in deck order.
+    """
+    heap = [
+        (states[key]["due"] if key in states else 0, i, key)
+        for i, key in enumerate(keys)
+    ]
+    heapq.heapify(heap)
+    return heap
+
+
+def pop_due(heap, now):
+    """Pop the most overdue card if one is due by now (O(log n)), else None."""
+    if heap and heap[0][0] <= now:
+        return heapq.heappop(heap)[2]
+    return None
+
+
+def study(file="truth.json", learner=None, limit=None):
+    """
+    Study the cards that are due, scheduling them with SM-2. Every answer is
+    appended to the learner's review log right away, so quitting at any
+    point loses nothing.
+
+    Args:
+      file: Ground truth JSON file with the deck.
+      learner: Optional learner name (each learner has their own log).
+      limit: Optional maximum number of cards for this session.
+    """
+    ground = CardStore.load(file)
+    log = review_log_path(file, learner)
+    states = load_schedule(log)
+    heap = due_queue(list(ground), states)
+    print("Grade each card from 0 (forgot) to 5 (perfect); type 'q' to stop.")
+    done = 0
+    while limit is None or done < limit:
+        now = int(time.time())
+        key = pop_due(heap, now)
+        if key is None:
+            print("Nothing else is due.")
+            break
+        card = ground[key]
+        input(f"Card (l{card.get('level', '?')}):\n\ten: {card['english']}\n")
+        print(f"\tzh: {card['chinese']}\n\tpy: {card['pinyin']}")
+        grade = input("\tgrade: ").strip()
+        while grade != "q" and not (grade.isdigit() and int(grade) <= 5):
+            grade = input("\tgrade (0-5 or q): ").strip()
+        if grade == "q":
+            break
+        record_review(log, key, int(grade), now)
+        states[key] = sm2(states.get(key), int(grade), now)
+        heapq.heappush(heap, (states[key]["due"], len(ground) + done, key))
+        done += 1
+    print(f"Reviewed {done} cards.")
+
+
+class VocabServer:
+    """
+    The deck kept resident for the serve daemon: a CardStore plus an
+    in-memory inverted index built with the same tokens as the search
+    index. Requests are JSON objects with an "op" field:
+
+      lookup  {"query": "laoshi", "limit": 20} -> list of cards
+      get     {"chinese": "老师"} -> card or null
+      add     {"card": {...}} -> "added" or "updated" (keyed by chinese)
+      export  {"file": "out.apkg", "format": null, "deck": "Chinese"} -> count
+      pinyin  {"text": "ni3hao3"} or {"items": [...]}, "mode": "marked"
+      flush   {} -> whether anything had to be written
+      stats   {} -> number of cards and pending changes
+
+    Added cards are written back to the deck in batches: the first change
+    schedules a flush flush_delay seconds later, so a burst of edits costs
+    one write. Flushes and exports work on a copy of the deck in other
+    threads, so the event loop keeps answering while they write; deck
+    writes go through a single writer thread and land in order. Changes
+    stay pending until a write of them succeeds; a failed flush is
+    reported on stderr and tried again flush_delay seconds later.
+    """
+
+    def __init__(self, file="truth.json", flush_delay=1.0):
+        self.file = file
+        self.flush_delay = flush_delay
+        self.cards = CardStore.load(file) if os.path.exists(file) else CardStore()
+        self.postings = collections.defaultdict(set)  # token -> rows
+        for row, card in enumerate(self.cards.values()):
+            for token in _search_tokens(card):
+                self.postings[token].add(row)
+        self.pending = 0  # changes not on disk yet
+        self._writing = 0  # of those, changes copied for a write in progress
+        self._flush_handle = None
+        self._writer = ThreadPoolExecutor(1)
+
+    async def handle(self, request):
+        """Answer one request; raises on malformed ones."""
+        op = request["op"]
+        if op == "lookup":
+            rows, substrings = _query_docs(self._lookup, request["query"])
+            results = []
+            for row in sorted(rows):
+                card = self.cards.card(row)
+                if all(chars in card.get("chinese", "") for chars in substrings):
+                    results.append(card.to_dict())
+                    if len(results) >= request.get("limit", 20):
+                        break
+            return results
+        if op == "get":
+            key = request["chinese"]
+            return self.cards[key].to_dict() if key in self.cards else None
+        if op == "add":
+            return self.add(request["card"])
+        if op == "export":
+            file = request["file"]
+            fmt = request.get("format") or EXPORT_EXTENSIONS.get(
+                os.path.splitext(file)[1].lower(), "fresh"
+            )
+            deck = request.get("deck", "Chinese")
+            cards = self.cards.to_json()
+            if isinstance(cards, dict):
+                cards = cards.values()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, export_cards, cards, file, fmt, deck
+            )
+        if op == "pinyin":
+            mode = request.get("mode", "marked")
+            if "items" in request:
+                return convert_pinyin_batch(request["items"], mode)
+            return PINYIN_MODES[mode](request["text"])
+        if op == "flush":
+            return await asyncio.wrap_future(self.flush())
+        if op == "stats":
+            return {"cards": len(self.cards), "pending": self.pending}
+        raise ValueError(f"unknown op: {op}")
+
+    def _lookup(self, token):
+        return self.postings.get(token, ())
+
+    def add(self, card):
+        key = card["chinese"]
+        if not isinstance(key, str) or not key:
+            raise ValueError("a card needs a chinese field")
+        for field in ("english", "pinyin"):
+            if not isinstance(card.get(field, ""), str):
+                raise ValueError(f"a card's {field} must be a string")
+        existed = key in self.cards
+        if existed:
+            old = self.cards[key]
+            row = old._row
+            for token in _search_tokens(old):
+                self.postings[token].discard(row)
+        self.cards[key] = card
+        row = self.cards[key]._row
+        for token in _search_tokens(card):
+            self.postings[token].add(row)
+        self.pending += 1
+        self._schedule_flush()
+        return "updated" if existed else "added"
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self):
+        """
+        Write pending changes to the deck file, if there are any. Only the
+        copy of the deck is taken here; the writer thread writes it.
 
         Returns:
-            The output of the command as a string, or None if an error occurred.
+          A concurrent.futures.Future of whether anything had to be written,
+          done once this and every earlier write is on disk.
         """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        changes = self.pending - self._writing
+        data = self.cards.to_json() if changes else None
+        self._writing += changes
+        future = self._writer.submit(self._write, data, changes)
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(
+            lambda done: loop.call_soon_threadsafe(self._written, done, changes)
+        )
+        return future
+
+    def _written(self, future, changes):
+        self._writing -= changes
+        if future.exception() is None:
+            self.pending -= changes
+            return
+        print(f"Flushing {self.file} failed: {future.exception()}", file=sys.stderr)
+        self._schedule_flush()
+
+    def _write(self, data, changes):
+        if data is None:
+            return False
+        with stage("flush") as info:
+            info["changes"] = changes
+            dump_json(data, self.file)
+        return True
+
+    async def client(self, reader, writer):
+        """Serve one connection: a JSON request per line, a JSON reply per line."""
         try:
-            process = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,  # Capture output as text (strings)
-                check=True,  # Raise CalledProcessError for non-zero return codes
-            )
-            return process.stdout.strip()  # remove leading/trailing whitespace
-        except subprocess.CalledProcessError as e:
-            print(f"Error executing command: {e}")
-            print(f"Stderr: {e.stderr}")  # print the error output
-            return None
-        except FileNotFoundError as e:
-            print(f"Command not found: {e}")
-            return None
-        except Exception as e:  # catch other potential exceptions.
-            print(f"An unexpected error occurred: {e}")
-            return None
+            while line := await reader.readline():
+                try:
+                    result = await self.handle(json.loads(line))
+                    reply = {"ok": True, "result": result}
+                except (
+                    KeyError,
+                    TypeError,
+                    ValueError,
+                    OSError,
+                    sqlite3.Error,
+                ) as error:
+                    message = f"{type(error).__name__}: {error}"
+                    reply = {"ok": False, "error": message}
+                writer.write(json.dumps(reply, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
 
-    listed = run_command(f"uv run pip list")
-    if "html2text" not in listed:
-        print("Installing html2text...")
-        run_command(f"uv pip install html2text")
-    cards = []
-    markdown = run_command(f"uv run html2text {filein}")
-    for line in markdown.split("\n"):
-        if line.count("|") == 2:
-            splits = list(map(lambda a: a.strip(), line.split("|")))
-            card = {
-                "chinese": splits[0],
-                "pinyin": splits[1],
-                "english": splits[2],
-                "level": level,
-            }
-            cards.append(card)
-    json.dump(cards, open(fileout, "w"), indent=4, ensure_ascii=False)
-    # body = json.loads(run_command(f"yq -p=xml -o=json {filein}"))["tbody"]["tr"]
-
-    # def traverse(json):
-    #     if isinstance(json, (str, int, float, bool)) or json is None:
-    #         return []
-    #     elif isinstance(json, dict):
-    #         t = []
-    #         if "+content" in json.keys():
-    #             t = [json["+content"]]
-    #         t += [item for sublist in map(traverse, json.values()) for item in sublist]
-    #         return t
-    #     elif isinstance(json, list):
-    #         t = []
-    #         for item in json:
-    #             t.extend(traverse(item))
-    #         return t
-    #     else:
-    #         raise TypeError(f"Unsupported type: {type(json)}")
-
-    # def getv(v, n):
-    #     return "".join(traverse(v["td"][n]["p"]["span"])).replace("&nbsp;", "").strip()
-
-    # cards = []
-    # for v in body:
-    #     # chinese; pinyin; english
-    #     cards.append(
-    #         {
-    #             "chinese": getv(v, 0),
-    #             "pinyin": getv(v, 1),
-    #             "english": getv(v, 2),
-    #             "level": level,
-    #         }
-    #     )
-    # json.dump(cards, open(fileout, "w"), indent=4, ensure_ascii=False)
+
+async def _serve(server, socket_path, host, port):
+    if socket_path is not None:
+        listener = await asyncio.start_unix_server(server.client, socket_path)
+        print(f"Serving {len(server.cards)} cards on {socket_path}")
+    else:
+        listener = await asyncio.start_server(server.client, host, port)
+        print(f"Serving {len(server.cards)} cards on {host}:{port}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(signum, stop.set)
+    async with listener:
+        await stop.wait()
+    await asyncio.wrap_future(server.flush())
+
+
+def serve(
+    file="truth.json", socket_path=None, host="127.0.0.1", port=8765, flush_delay=1.0
+):
+    """
+    Keep the deck loaded and answer requests (see VocabServer) until
+    interrupted, over a Unix socket or a localhost TCP port. Pending
+    changes are flushed to the deck on shutdown.
+
+    Args:
+      file: Deck to serve and write changes back to.
+      socket_path: Unix socket to listen on (instead of host/port).
+      host, port: TCP address to listen on.
+      flush_delay: Seconds to collect changes before writing them.
+    """
+    server = VocabServer(file, flush_delay)
+    try:
+        asyncio.run(_serve(server, socket_path, host, port))
+    finally:
+        server._writer.shutdown()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Chinese Vocabulary Utility CLI\n\n"
-        "Available subcommands: add, merge, review, custom, truth-to-card, load-xml",
+        "Available subcommands: add, add-xml, build-index, merge, dups, consolidate,\n"
+        "store, review, normalize, lint, snapshot, custom, pinyin, truth-to-card,\n"
+        "load-xml, search, coverage, study, serve",
         formatter_class=argparse.RawTextHelpFormatter,
     )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        help="Append per-stage timings (wall, CPU, peak RSS, counts) to this file",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="Write a cProfile dump of the command to this file (implies metrics;\n"
+        "printed to stderr unless --metrics is given)",
+    )
     subparsers = parser.add_subparsers(dest="command", help="Sub-command help")
 
     # Subcommand: add
@@ -501,14 +4219,177 @@ def main():
         help="Comma-separated list of lesson numbers to include, e.g., '1,2,3'",
     )
 
+    # Subcommand: add-xml
+    parser_add_xml = subparsers.add_parser(
+        "add-xml",
+        help="Stream vocabulary from a Pleco XML flashcard export into a vocabulary file.",
+    )
+    parser_add_xml.add_argument("input_file", help="Pleco .xml flashcard export")
+    parser_add_xml.add_argument(
+        "output_file", help="Output JSON file for vocabulary (e.g., cards.json)"
+    )
+    parser_add_xml.add_argument(
+        "-l",
+        "--lessons",
+        type=str,
+        default=None,
+        help="Comma-separated list of lesson numbers to include (default: all)",
+    )
+
+    # Subcommand: build-index
+    parser_index = subparsers.add_parser(
+        "build-index",
+        help="Compile ic_truth.json into the lesson index used by add (only if it changed).",
+    )
+    parser_index.add_argument(
+        "-i",
+        "--input",
+        default="ic_truth.json",
+        help="Pleco XML-to-JSON dump to compile (default: ic_truth.json)",
+    )
+    parser_index.add_argument(
+        "-d",
+        "--index-dir",
+        default=IC_INDEX_DIR,
+        help=f"Directory for the compiled index (default: {IC_INDEX_DIR})",
+    )
+
     # Subcommand: merge
     parser_merge = subparsers.add_parser(
-        "merge", help="Merge a vocabulary file into the ground truth file (truth.json)"
+        "merge",
+        help="Merge vocabulary files into the ground truth file (truth.json)",
+        description="Merge vocabulary files into truth.json. Without --policy, "
+        "conflicts are resolved interactively; with it, the merge runs unattended.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser_merge.add_argument(
+        "vocab_file",
+        nargs="+",
+        help="Vocabulary JSON file(s) to merge (e.g., cards.json)",
+    )
+    parser_merge.add_argument(
+        "-p",
+        "--policy",
+        choices=MERGE_POLICIES,
+        default=None,
+        help="Resolve conflicts without prompting:\n"
+        + "\n".join(f"  {name}: {doc}" for name, doc in MERGE_POLICIES.items()),
     )
     parser_merge.add_argument(
-        "vocab_file", help="Vocabulary JSON file to merge (e.g., cards.json)"
+        "-o",
+        "--output",
+        default="truth.json",
+        help="Where to write the merged ground truth with --policy (default: truth.json)",
+    )
+    parser_merge.add_argument(
+        "-c",
+        "--conflicts",
+        default=None,
+        help="JSON file for conflicts the policy could not resolve",
+    )
+    parser_merge.add_argument(
+        "--near",
+        action="store_true",
+        help="Without --policy, also resolve clusters of near-duplicate cards",
+    )
+    parser_merge.add_argument(
+        "--duplicates",
+        default=None,
+        help="With --policy, write clusters of near-duplicate cards to this file",
+    )
+    parser_merge.add_argument(
+        "--db",
+        default=None,
+        help="With --policy, merge into this SQLite store instead of truth.json",
+    )
+
+    # Subcommand: dups
+    parser_dups = subparsers.add_parser(
+        "dups", help="Find clusters of near-duplicate cards in a deck."
+    )
+    parser_dups.add_argument(
+        "file", nargs="?", default="truth.json", help="Deck (default: truth.json)"
+    )
+    parser_dups.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.6,
+        help="Minimum feature similarity of duplicates (default: 0.6)",
+    )
+    parser_dups.add_argument(
+        "-o", "--output", default=None, help="Write the clusters to this JSON file"
     )
 
+    # Subcommand: consolidate
+    parser_consolidate = subparsers.add_parser(
+        "consolidate",
+        help="Merge a whole directory of vocabulary files into truth.json at once.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser_consolidate.add_argument(
+        "paths",
+        nargs="*",
+        default=["user"],
+        help="Vocabulary files and/or directories (default: user)",
+    )
+    parser_consolidate.add_argument(
+        "-p",
+        "--policy",
+        choices=MERGE_POLICIES,
+        default="lowest-level",
+        help="How to resolve conflicts (default: lowest-level):\n"
+        + "\n".join(f"  {name}: {doc}" for name, doc in MERGE_POLICIES.items()),
+    )
+    parser_consolidate.add_argument(
+        "-o",
+        "--output",
+        default="truth.json",
+        help="Where to write the ground truth (default: truth.json)",
+    )
+    parser_consolidate.add_argument(
+        "-c",
+        "--conflicts",
+        default=None,
+        help="JSON file for conflicts the policy could not resolve",
+    )
+    parser_consolidate.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Worker processes (default: cores)"
+    )
+
+    # Subcommand: store
+    parser_store = subparsers.add_parser(
+        "store", help="Copy the ground truth between truth.json and a SQLite store."
+    )
+    store_actions = parser_store.add_subparsers(dest="action", required=True)
+    parser_store_import = store_actions.add_parser(
+        "import", help="Load a truth.json-style file into the store."
+    )
+    parser_store_import.add_argument(
+        "file",
+        nargs="?",
+        default="truth.json",
+        help="Input JSON (default: truth.json)",
+    )
+    parser_store_export = store_actions.add_parser(
+        "export", help="Write the store (optionally filtered) as truth.json-style JSON."
+    )
+    parser_store_export.add_argument(
+        "file",
+        nargs="?",
+        default="truth.json",
+        help="Output JSON (default: truth.json)",
+    )
+    parser_store_export.add_argument("--min-level", type=int, default=None)
+    parser_store_export.add_argument("--max-level", type=int, default=None)
+    parser_store_export.add_argument(
+        "--pos", default=None, help="Only cards of this part of speech, e.g. 'verb'"
+    )
+    for store_parser in (parser_store_import, parser_store_export):
+        store_parser.add_argument(
+            "-d", "--db", default=TRUTH_DB, help=f"SQLite store (default: {TRUTH_DB})"
+        )
+
     # Subcommand: review
     parser_review = subparsers.add_parser(
         "review",
@@ -518,6 +4399,70 @@ def main():
         "file", help="JSON file of vocabulary to review (e.g., cards.json)"
     )
 
+    # Subcommand: normalize
+    parser_normalize = subparsers.add_parser(
+        "normalize",
+        help="Expand grammar type abbreviations in whole files, without prompts.",
+    )
+    parser_normalize.add_argument(
+        "paths", nargs="+", help="Vocabulary JSON files and/or directories of them"
+    )
+    parser_normalize.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Output file (one input) or directory (default: in place)",
+    )
+    parser_normalize.add_argument(
+        "-r",
+        "--report",
+        default=None,
+        help="JSON file for the cards that could not be classified",
+    )
+    parser_normalize.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Worker processes (default: cores)"
+    )
+
+    # Subcommand: lint
+    parser_lint = subparsers.add_parser(
+        "lint",
+        help="Check cards for pinyin, character and definition problems.",
+        description="Checks:\n"
+        + "\n".join(f"  {code}: {doc}" for code, doc in LINT_CHECKS.items())
+        + "\n\nExits with status 1 if any error is found.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser_lint.add_argument(
+        "paths",
+        nargs="*",
+        default=["truth.json"],
+        help="Vocabulary JSON files and/or directories (default: truth.json)",
+    )
+    parser_lint.add_argument(
+        "--fix", action="store_true", help="Rewrite fixable problems in place"
+    )
+    parser_lint.add_argument(
+        "--json", action="store_true", help="Print diagnostics as JSON lines"
+    )
+    parser_lint.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Worker processes (default: cores)"
+    )
+
+    # Subcommand: snapshot
+    parser_snapshot = subparsers.add_parser(
+        "snapshot",
+        help="Compile the deck into a memory-mappable read-only snapshot.",
+    )
+    parser_snapshot.add_argument(
+        "file", nargs="?", default="truth.json", help="Deck (default: truth.json)"
+    )
+    parser_snapshot.add_argument(
+        "-o",
+        "--output",
+        default=SNAPSHOT,
+        help=f"Snapshot file (default: {SNAPSHOT})",
+    )
+
     # Subcommand: custom
     parser_custom = subparsers.add_parser(
         "custom", help="Interactively import custom vocabulary into a JSON file."
@@ -534,19 +4479,89 @@ def main():
         help="Default lesson number for all entries (optional)",
     )
 
+    # Subcommand: pinyin
+    parser_pinyin = subparsers.add_parser(
+        "pinyin",
+        help="Convert pinyin between numbered, tone-marked, spaced and toneless forms.",
+    )
+    parser_pinyin.add_argument(
+        "text", nargs="*", help="Pinyin to convert (default: read lines from stdin)"
+    )
+    parser_pinyin.add_argument(
+        "-m",
+        "--mode",
+        choices=PINYIN_MODES,
+        default="marked",
+        help="Target form (default: marked)",
+    )
+    parser_pinyin.add_argument(
+        "-i",
+        "--input",
+        default=None,
+        help="Convert this file (JSON vocabulary or plain text) instead",
+    )
+    parser_pinyin.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Output file for --input (default: in place)",
+    )
+
     # Subcommand: truth-to-card
     parser_truth = subparsers.add_parser(
         "truth-to-card",
-        help="Export the ground truth (truth.json) to a text file for Fresh Cards/Anki.",
+        help="Export the ground truth (truth.json) for Fresh Cards/Anki/Pleco.",
+    )
+    parser_truth.add_argument("output_file", help="Output file (e.g., export.txt)")
+    parser_truth.add_argument(
+        "-f",
+        "--format",
+        choices=EXPORT_FORMATS,
+        default=None,
+        help="Export format (default: from the file extension, else fresh)",
+    )
+    parser_truth.add_argument(
+        "--deck", default="Chinese", help="Deck name for the Anki formats"
+    )
+    parser_truth.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Only re-export if cards changed since the last export (per-card hashes)",
+    )
+    parser_truth.add_argument(
+        "--delta",
+        default=None,
+        help="Write only added/changed cards to this file (implies --incremental)",
+    )
+    parser_truth.add_argument(
+        "--report",
+        default=None,
+        help="JSON file listing added/changed/removed keys (implies --incremental)",
+    )
+    parser_truth.add_argument(
+        "--db",
+        default=None,
+        help="Export from this SQLite store instead of truth.json",
+    )
+    parser_truth.add_argument(
+        "-w",
+        "--where",
+        default=None,
+        help="Only export the cards matching a filter, e.g.\n"
+        "'level>=3 and level<=5 and pos:verb and not tag:proper'\n"
+        "(terms: level<op>N, pos:TYPE, tag:TAG, FIELD:TEXT; and/or/not/())",
     )
-    parser_truth.add_argument("output_file", help="Output text file (e.g., export.txt)")
 
     # Subcommand: load-xml
     parser_xml = subparsers.add_parser(
-        "load-xml", help="Load vocabulary from an HTML table file into a JSON file."
+        "load-xml", help="Load vocabulary from HTML table files into a JSON file."
     )
     parser_xml.add_argument(
-        "input_file", help="Input HTML file containing the vocabulary table"
+        "input_file",
+        nargs="+",
+        help="Input HTML file(s) containing the vocabulary table; use FILE:LEVEL\n"
+        "to give one file its own level",
     )
     parser_xml.add_argument(
         "output_file", help="Output JSON file for vocabulary (e.g., vocabulary.json)"
@@ -556,35 +4571,347 @@ def main():
         type=int,
         help="Level number (int) to assign to all imported vocabulary entries",
     )
+    parser_xml.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Worker processes for several files (default: one per core)",
+    )
+
+    # Subcommand: search
+    parser_search = subparsers.add_parser(
+        "search",
+        help="Look up cards by English, pinyin (with or without tones) or characters.",
+    )
+    parser_search.add_argument("query", nargs="+", help="Search terms (all must match)")
+    parser_search.add_argument(
+        "-n", "--limit", type=int, default=20, help="Maximum results (default: 20)"
+    )
+    parser_search.add_argument(
+        "--json", action="store_true", help="Print results as JSON lines"
+    )
+
+    # Subcommand: coverage
+    parser_coverage = subparsers.add_parser(
+        "coverage",
+        help="Measure how much of Chinese text files the vocabulary covers.",
+    )
+    parser_coverage.add_argument(
+        "paths", nargs="+", help="Text files and/or directories of them (UTF-8)"
+    )
+    parser_coverage.add_argument(
+        "-t",
+        "--truth",
+        default="truth.json",
+        help="Vocabulary to measure (default: truth.json)",
+    )
+    parser_coverage.add_argument(
+        "-n",
+        "--top",
+        type=int,
+        default=20,
+        help="How many frequent words and unknown segments to list (default: 20)",
+    )
+    parser_coverage.add_argument(
+        "--json", action="store_true", help="Print the report as JSON"
+    )
+    parser_coverage.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Worker processes (default: cores)"
+    )
+
+    # Subcommand: study
+    parser_study = subparsers.add_parser(
+        "study", help="Study due cards with spaced repetition (SM-2)."
+    )
+    parser_study.add_argument(
+        "file", nargs="?", default="truth.json", help="Deck (default: truth.json)"
+    )
+    parser_study.add_argument(
+        "-u", "--learner", default=None, help="Learner name (separate review log)"
+    )
+    parser_study.add_argument(
+        "-n", "--limit", type=int, default=None, help="Maximum cards this session"
+    )
+    parser_study.add_argument(
+        "--due",
+        action="store_true",
+        help="Only print how many cards are due now and which come next",
+    )
+
+    # Subcommand: serve
+    parser_serve = subparsers.add_parser(
+        "serve",
+        help="Keep the deck in memory and answer requests over a local socket.",
+        description="Serve lookup, get, add, export, pinyin, flush and stats\n"
+        'requests as JSON lines, e.g. {"op": "lookup", "query": "laoshi"}.',
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser_serve.add_argument(
+        "file", nargs="?", default="truth.json", help="Deck (default: truth.json)"
+    )
+    parser_serve.add_argument(
+        "-s", "--socket", default=None, help="Listen on this Unix socket"
+    )
+    parser_serve.add_argument(
+        "--host", default="127.0.0.1", help="TCP host (default: 127.0.0.1)"
+    )
+    parser_serve.add_argument(
+        "--port", type=int, default=8765, help="TCP port (default: 8765)"
+    )
+    parser_serve.add_argument(
+        "--flush-delay",
+        type=float,
+        default=1.0,
+        help="Seconds to batch changes before writing the deck (default: 1)",
+    )
 
     # Parse arguments
     args = parser.parse_args()
 
     if not args.command:
         parser.print_help()
-        return
+        return None
+
+    global _metrics, _command
+    if args.metrics is None and args.profile is None:
+        return run_command(parser, args)
+    _metrics, _command = [], args.command
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        with stage("total"):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                run_command(parser, args)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(args.profile)
+        if args.metrics is not None:
+            with open(args.metrics, "a", encoding="utf-8") as f:
+                f.writelines(
+                    json.dumps(record, ensure_ascii=False) + "\n" for record in _metrics
+                )
+        else:
+            for record in _metrics:
+                print(json.dumps(record, ensure_ascii=False), file=sys.stderr)
+        _metrics = None
+
+
+def _parse_lessons(text):
+    """
+    Lesson numbers from a comma-separated list such as '1,2,3', or None
+    (after saying why) if text is not one.
+    """
+    try:
+        return [int(x.strip()) for x in text.split(",")]
+    except ValueError:
+        print(
+            "Error parsing lessons. Make sure to provide a comma-separated list of numbers."
+        )
+        return None
+
+
+def run_command(parser, args):
+    """Dispatch parsed command-line arguments to the matching function."""
 
     # Dispatch to the corresponding function based on command
     if args.command == "add":
-        # Parse lessons: comma-separated list of integers
-        try:
-            lesson_list = [int(x.strip()) for x in args.lessons.split(",")]
-        except Exception:
-            print(
-                "Error parsing lessons. Make sure to provide a comma-separated list of numbers."
-            )
+        lesson_list = _parse_lessons(args.lessons)
+        if lesson_list is None:
             return
         add(lesson_list, args.output_file)
+    elif args.command == "add-xml":
+        lesson_list = None
+        if args.lessons is not None:
+            lesson_list = _parse_lessons(args.lessons)
+            if lesson_list is None:
+                return
+        count = add_xml(args.input_file, lesson_list, args.output_file)
+        print(f"Imported {count} cards.")
+    elif args.command == "build-index":
+        manifest = build_ic_index(args.input, args.index_dir)
+        total = sum(manifest["lessons"].values())
+        print(f"Indexed {total} cards in {len(manifest['lessons'])} lessons.")
     elif args.command == "merge":
-        merge(args.vocab_file)
+        if args.policy is None:
+            for i, vocab_file in enumerate(args.vocab_file, 1):
+                merge(vocab_file, near=args.near and i == len(args.vocab_file))
+        else:
+            resolved, unresolved = merge_batch(
+                args.vocab_file,
+                args.policy,
+                output=args.output,
+                conflicts_file=args.conflicts,
+                db=args.db,
+                duplicates_file=args.duplicates,
+            )
+            print(f"Resolved {resolved} conflicts, {unresolved} unresolved.")
+    elif args.command == "dups":
+        with open(args.file, encoding="utf-8") as f:
+            ground = json.load(f)
+        clusters = duplicate_clusters(ground, args.threshold)
+        if args.output is not None:
+            dump_json([[ground[key] for key in keys] for keys in clusters], args.output)
+        for keys in clusters:
+            print(
+                " | ".join(
+                    f"{key} ({ground[key].get('pinyin')}) {ground[key].get('english')}"
+                    for key in keys
+                )
+            )
+        print(f"{len(clusters)} clusters of near-duplicates.")
+    elif args.command == "consolidate":
+        added, resolved, unresolved = consolidate(
+            args.paths,
+            args.policy,
+            output=args.output,
+            conflicts_file=args.conflicts,
+            jobs=args.jobs,
+        )
+        print(
+            f"Added {added} cards; resolved {resolved} conflicts, "
+            f"{unresolved} unresolved."
+        )
+    elif args.command == "store":
+        if args.action == "import":
+            count = store_import(args.file, args.db)
+            print(f"Imported {count} cards into {args.db}.")
+        else:
+            count = store_export(
+                args.db,
+                args.file,
+                min_level=args.min_level,
+                max_level=args.max_level,
+                pos=args.pos,
+            )
+            print(f"Exported {count} cards to {args.file}.")
     elif args.command == "review":
         review(args.file)
+    elif args.command == "normalize":
+        results = normalize(args.paths, args.output, args.report, args.jobs)
+        for file, (cards, expanded, unclassified) in results.items():
+            print(
+                f"{file}: {cards} cards, {expanded} expanded, "
+                f"{unclassified} unclassified"
+            )
+    elif args.command == "lint":
+        diagnostics, fixed = lint(args.paths, args.fix, args.jobs)
+        for d in diagnostics:
+            if args.json:
+                print(json.dumps(d, ensure_ascii=False))
+            else:
+                print(
+                    f"{d['file']}:{d['index']}: {d['severity']} {d['code']}: "
+                    f"{d['message']}{' (fixed)' if d['fixed'] else ''}"
+                )
+        errors = sum(d["severity"] == "error" for d in diagnostics)
+        print(
+            f"{len(diagnostics)} problems ({errors} errors), {fixed} cards fixed.",
+            file=sys.stderr,
+        )
+        if errors:
+            sys.exit(1)
+    elif args.command == "snapshot":
+        count = write_snapshot(args.file, args.output)
+        print(f"Wrote {count} cards to {args.output}.")
     elif args.command == "custom":
         custom(args.output_file, lesson=args.lesson)
+    elif args.command == "pinyin":
+        if args.input is not None:
+            count = convert_pinyin_file(
+                args.input, args.output or args.input, args.mode
+            )
+            print(f"Converted {count} entries.")
+        elif args.text:
+            print(PINYIN_MODES[args.mode](" ".join(args.text)))
+        else:
+            for line in sys.stdin:
+                print(PINYIN_MODES[args.mode](line.rstrip("\n")))
     elif args.command == "truth-to-card":
-        truth_to_card(args.output_file)
+        accept = None
+        if args.where is not None:
+            try:
+                accept = CardFilter(args.where)
+            except ValueError as error:
+                parser.error(str(error))
+        if args.incremental or args.delta or args.report:
+            report = export_delta(
+                args.output_file,
+                accept,
+                db=args.db,
+                fmt=args.format,
+                deck=args.deck,
+                delta_file=args.delta,
+                report_file=args.report,
+            )
+            print(
+                f"Added {len(report['added'])}, changed {len(report['changed'])}, "
+                f"removed {len(report['removed'])} cards."
+            )
+        else:
+            count = truth_to_card(
+                args.output_file, accept, db=args.db, fmt=args.format, deck=args.deck
+            )
+            print(f"Exported {count} cards.")
     elif args.command == "load-xml":
-        load_xml(args.input_file, args.output_file, args.level)
+        files = []
+        for name in args.input_file:
+            path, sep, level = name.rpartition(":")
+            if sep and level.isdigit():
+                files.append((path, int(level)))
+            else:
+                files.append((name, args.level))
+        count = load_xml(files, args.output_file, args.level, jobs=args.jobs)
+        print(f"Loaded {count} cards.")
+    elif args.command == "search":
+        for source, card in search(" ".join(args.query), args.limit):
+            if args.json:
+                print(json.dumps({"source": source, **card}, ensure_ascii=False))
+            else:
+                print(
+                    f"{card['chinese']} ({card['pinyin']}) "
+                    f"[l{card.get('level', '?')}] {card['english']}  <{source}>"
+                )
+    elif args.command == "coverage":
+        report = coverage(args.paths, args.truth, args.jobs)
+        report["words"] = dict(report["words"].most_common(args.top))
+        report["unknown"] = dict(report["unknown"].most_common(args.top))
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        elif report["characters"]:
+            print(
+                f"Coverage: {report['coverage']:.1%} of "
+                f"{report['characters']} characters"
+            )
+            for level, share in report["by_level"].items():
+                print(f"  up to level {level}: {share:.1%}")
+            print("Most frequent unknown segments:")
+            for segment, count in report["unknown"].items():
+                print(f"  {segment}\t{count}")
+            print("Most frequent known words:")
+            for word, count in report["words"].items():
+                print(f"  {word}\t{count}")
+        else:
+            print("No Chinese characters found.")
+    elif args.command == "study":
+        if args.due:
+            with open(args.file, encoding="utf-8") as f:
+                keys = list(json.load(f))
+            states = load_schedule(review_log_path(args.file, args.learner))
+            heap = due_queue(keys, states)
+            now = int(time.time())
+            due = []
+            while (key := pop_due(heap, now)) is not None:
+                due.append(key)
+            print(f"{len(due)} cards due: {' '.join(due[:20])}")
+        else:
+            study(args.file, args.learner, args.limit)
+    elif args.command == "serve":
+        serve(args.file, args.socket, args.host, args.port, args.flush_delay)
     else:
         parser.print_help()
 
@@ -0,0 +1,12 @@
+import main
+
+
+def test_unknown_runs_end_at_punctuation_and_newlines(tmp_path):
+    text = tmp_path / "text.txt"
+    text.write_text("老师犸猹，犰狳\n犸猹\n\n犰狳老师", encoding="utf-8")
+    main._init_coverage({"老师": 1})
+
+    chars, words, unknown = main._file_coverage(str(text))
+    assert unknown == {"犸猹": 2, "犰狳": 2}
+    assert words == {"老师": 2}
+    assert chars == {None: 8, 1: 4}
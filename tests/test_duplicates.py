@@ -0,0 +1,57 @@
+import main
+
+FRUIT = [
+    "apple",
+    "banana",
+    "cherry",
+    "grape",
+    "lemon",
+    "mango",
+    "olive",
+    "peach",
+    "plum",
+    "melon",
+]
+
+
+def card(first):
+    """A card of eight English words from FRUIT[first]: neighbours share 7 of 9."""
+    return {"english": " ".join(FRUIT[first : first + 8]), "pinyin": "", "chinese": ""}
+
+
+def find(cards, threshold=0.6, **kwargs):
+    return main.find_duplicates(cards, threshold, src="missing.json", **kwargs)
+
+
+def test_threshold_bounds_the_feature_similarity():
+    cards = [card(0), card(1)]
+    assert find(cards, 0.75) == [[0, 1]]
+    assert find(cards, 0.8) == []
+
+
+def test_union_find_joins_transitive_pairs():
+    cards = [card(0), card(1), card(2)]
+    # 0 and 2 share only 6 of 10 words, but both pair with 1
+    assert find(cards[::2], 0.7) == []
+    assert find(cards, 0.7) == [[0, 1, 2]]
+
+
+def test_buckets_over_max_bucket_are_not_expanded():
+    teacher = {"english": "teacher", "pinyin": "lǎoshī", "chinese": "老师"}
+    cards = [teacher, card(0), dict(teacher), dict(teacher)]
+    assert find(cards) == [[0, 2, 3]]
+    assert find(cards, max_bucket=3) == [[0, 2, 3]]
+    assert find(cards, max_bucket=2) == []
+
+
+def test_resolve_deletes_the_named_versions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # no Pleco dump to learn from
+    ground = main.CardStore.from_json(
+        {"a": card(0), "b": card(1), "c": card(2), "d": card(5)}
+    )
+    clusters = main.duplicate_clusters(ground, 0.7)
+    assert clusters == [["a", "b", "c"]]
+    answers = iter(["4", "3, 1"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+    main.resolve_duplicates(ground, clusters)
+    assert list(ground) == ["b", "d"]
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+import main
+
+CARDS = {
+    "你": {"english": "pronoun: you", "chinese": "你", "pinyin": "nǐ", "level": 1},
+    "好": {"english": "adjective: good", "chinese": "好", "pinyin": "hǎo", "level": 1},
+    "老师": {
+        "english": "noun: teacher",
+        "chinese": "老师",
+        "pinyin": "lǎoshī",
+        "level": 2,
+    },
+}
+
+
+@pytest.fixture
+def deck(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def write(cards):
+        main.dump_json(cards, "truth.json")
+
+    write(CARDS)
+    return write
+
+
+def read_tsv(file):
+    with open(file, encoding="utf-8") as f:
+        return [line.rstrip("\n").split("\t") for line in f if not line.startswith("#")]
+
+
+def test_delta_does_not_hide_changes_from_the_full_export(deck):
+    main.export_delta("deck.tsv")
+    changed = dict(CARDS, 好={**CARDS["好"], "english": "adjective: fine"})
+    deck(changed)
+
+    report = main.export_delta("deck.tsv", delta_file="delta.tsv")
+    assert report["changed"] == ["好"]
+    assert [row[1] for row in read_tsv("delta.tsv")] == ["好"]
+
+    # the full export still has the old definition and must be rewritten
+    report = main.export_delta("deck.tsv")
+    assert report["changed"] == ["好"]
+    assert ["adjective: fine", "好", "hǎo", "ic1"] in read_tsv("deck.tsv")
+
+    # and the delta stream has already shipped the change
+    report = main.export_delta("deck.tsv", delta_file="delta2.tsv")
+    assert report == {"added": [], "changed": [], "removed": []}
+    assert read_tsv("delta2.tsv") == []
+
+
+def test_removals_are_written_as_tombstones(deck):
+    main.export_delta("deck.tsv")
+    deck({key: card for key, card in CARDS.items() if key != "老师"})
+
+    report = main.export_delta("deck.tsv", delta_file="delta.tsv")
+    assert report["removed"] == ["老师"]
+    assert read_tsv("delta.tsv") == [["", "老师", "", "deleted"]]
+    with open("deck.tsv.delta.manifest.json", encoding="utf-8") as f:
+        assert "老师" not in json.load(f)["cards"]
+
+    report = main.export_delta("deck.tsv")
+    assert report["removed"] == ["老师"]
+    assert all(row[1] != "老师" for row in read_tsv("deck.tsv"))
@@ -0,0 +1,74 @@
+import os
+
+import main
+
+CARDS = {
+    "说": {"english": "v: to speak", "pinyin": "shuō", "chinese": "说", "level": 1},
+    "书": {"english": "n: book", "pinyin": "shū", "chinese": "书", "level": 2},
+    "写": {"english": "v: to write", "pinyin": "xiě", "chinese": "写", "level": 3},
+    "好": {"english": "adj: good", "pinyin": "hǎo", "chinese": "好"},
+}
+
+
+def test_rows_see_appended_cards():
+    store = main.CardStore.from_json(CARDS)
+    assert store.rows(max_level=1) == [0]
+    store["读"] = {"english": "v: to read", "pinyin": "dú", "chinese": "读", "level": 1}
+    store.append({"english": "v: to eat", "pinyin": "chī", "chinese": "吃", "level": 1})
+    assert store.rows(max_level=1) == [0, 4, 5]
+
+
+def test_store_pos_filter_escapes_like_wildcards(tmp_path):
+    conn = main.open_store(str(tmp_path / "truth.db"))
+    try:
+        main.store_upsert(conn, CARDS.values())
+        assert [c["chinese"] for c in main.store_cards(conn, pos="verb")] == [
+            "说",
+            "写",
+        ]
+        assert list(main.store_cards(conn, pos="%")) == []
+        assert list(main.store_cards(conn, pos="ver_")) == []
+    finally:
+        conn.close()
+
+
+def test_snapshot_answers_filters_until_the_deck_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    main.dump_json(CARDS, "truth.json")
+    main.write_snapshot()
+    accept = main.CardFilter("level>=2 and level<=3")
+    with main.current_snapshot() as snapshot:
+        assert snapshot.rows(min_level=2, max_level=3) == [1, 2]
+    assert [c["chinese"] for c in main._truth_cards(accept)] == ["书", "写"]
+
+    stat = os.stat("truth.json")
+    os.utime("truth.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert main.current_snapshot() is None
+    assert [c["chinese"] for c in main._truth_cards(accept)] == ["书", "写"]
+
+
+def test_deleted_rows_leave_the_store_until_compacted(tmp_path):
+    store = main.CardStore.from_json(CARDS)
+    store["说"]["english"] = "v: to say"  # leaves dead bytes behind
+    del store["书"]
+    assert len(store) == 3
+    assert "书" not in store
+    assert list(store) == ["说", "写", "好"]
+    assert store.rows(min_level=1) == [0, 2]
+    assert store.card(2)["chinese"] == "写"
+
+    store.compact()
+    assert store.rows(min_level=1) == [0, 1]
+    assert store.card(1)["chinese"] == "写"
+    assert store["说"]["english"] == "v: to say"
+    main.dump_json(store, str(tmp_path / "truth.json"))
+    expected = {key: card for key, card in CARDS.items() if key != "书"}
+    expected["说"] = {**CARDS["说"], "english": "v: to say"}
+    assert main.load_cards(str(tmp_path / "truth.json")) == list(expected.values())
+
+
+def test_unkeyed_delete_falls_back_to_the_next_card_with_that_chinese():
+    store = main.CardStore.from_json([CARDS["说"], {**CARDS["说"], "level": 4}])
+    del store["说"]
+    assert store["说"]["level"] == 4
+    assert store.to_json() == [{**CARDS["说"], "level": 4}]
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import main
+
+
+def test_review_resumes_after_a_torn_journal_record(tmp_path, monkeypatch, capsys):
+    deck = str(tmp_path / "cards.json")
+    main.dump_json(
+        [
+            {"english": "noun: book", "pinyin": "shū", "chinese": "书", "level": 1},
+            {"english": "verb: to say", "pinyin": "shuō", "chinese": "说", "level": 1},
+            {"english": "verb: to write", "pinyin": "xiě", "chinese": "写", "level": 1},
+        ],
+        deck,
+    )
+    answers = iter(["noun: a book"])
+
+    def interrupted(prompt):
+        for answer in answers:
+            return answer
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr("builtins.input", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        main.review(deck)
+    journal = main.journal_path(deck)
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"next": 2, "card": 1, "engl')
+
+    prompts = []
+    monkeypatch.setattr("builtins.input", lambda prompt: prompts.append(prompt) or "")
+    main.review(deck)
+    assert "Resuming at card 2 of 3" in capsys.readouterr().out
+    assert len(prompts) == 2
+    assert [card["english"] for card in main.load_cards(deck)] == [
+        "noun: a book",
+        "verb: to say",
+        "verb: to write",
+    ]
+    assert not os.path.exists(journal)
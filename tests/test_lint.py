@@ -0,0 +1,33 @@
+import main
+
+
+def test_single_deck_is_linted_in_chunks(tmp_path, monkeypatch):
+    cards = {
+        "你好": {
+            "english": "hello",
+            "pinyin": "ni3hao3",
+            "chinese": "你好",
+            "level": 1,
+        },
+        "老师": {"english": "", "pinyin": "lǎoshī", "chinese": "老师", "level": 1},
+        "学生": {"english": "student", "pinyin": "xuésheng", "chinese": "学生"},
+        "谢谢": {
+            "english": "thanks",
+            "pinyin": "xiè xie",
+            "chinese": "谢谢",
+            "level": 2,
+        },
+        "书": {"english": "book", "pinyin": "shuu", "chinese": "书", "level": 2},
+    }
+    whole, chunked = tmp_path / "whole.json", tmp_path / "chunked.json"
+    main.dump_json(cards, str(whole))
+    main.dump_json(cards, str(chunked))
+    expected, fixed = main.lint([str(whole)], fix=True, jobs=1)
+
+    monkeypatch.setattr(main, "CHUNK_CARDS", 2)
+    diagnostics, chunked_fixed = main.lint([str(chunked)], fix=True, jobs=2)
+    assert [{**d, "file": None} for d in diagnostics] == [
+        {**d, "file": None} for d in expected
+    ]
+    assert (chunked_fixed, fixed) == (1, 1)
+    assert chunked.read_text(encoding="utf-8") == whole.read_text(encoding="utf-8")
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import main
+
+TRUTH = {
+    "书": {"english": "noun: book", "pinyin": "shū", "chinese": "书", "level": 3},
+    "说": {"english": "verb: to speak", "pinyin": "shuō", "chinese": "说", "level": 1},
+}
+INCOMING = [
+    {"english": "noun: book; volume", "pinyin": "shū", "chinese": "书", "level": 2},
+    {"english": "verb: to say", "pinyin": "shuō", "chinese": "说", "level": 1},
+    {"english": "verb: to write", "pinyin": "xiě", "chinese": "写", "level": 4},
+    {"english": "noun: letter", "pinyin": "shū", "chinese": "书", "level": 5},
+]
+
+
+def read(file):
+    with open(file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def merge(tmp_path, policy, **kwargs):
+    truth, incoming = str(tmp_path / "truth.json"), str(tmp_path / "incoming.json")
+    main.dump_json(TRUTH, truth)
+    main.dump_json(INCOMING, incoming)
+    conflicts = str(tmp_path / "conflicts.json")
+    counts = main.merge_batch(
+        [incoming],
+        policy,
+        truth=truth,
+        output=truth,
+        conflicts_file=conflicts,
+        **kwargs,
+    )
+    return counts, read(truth), read(conflicts)
+
+
+@pytest.mark.parametrize(
+    ("policy", "book", "speak"),
+    [
+        ("prefer-truth", "noun: book", "verb: to speak"),
+        ("prefer-incoming", "noun: letter", "verb: to say"),
+    ],
+)
+def test_keep_first_and_keep_last(tmp_path, policy, book, speak):
+    (resolved, unresolved), truth, _ = merge(tmp_path, policy)
+    assert (resolved, unresolved) == (2, 0)
+    assert truth["书"]["english"] == book
+    assert truth["说"]["english"] == speak
+    assert truth["写"] == INCOMING[2]
+
+
+def test_lowest_level_leaves_ties_unresolved(tmp_path):
+    (resolved, unresolved), truth, conflicts = merge(tmp_path, "lowest-level")
+    assert (resolved, unresolved) == (1, 1)
+    assert truth["书"] == INCOMING[0]
+    # both versions of 说 are level 1: the truth version stays
+    assert truth["说"] == TRUTH["说"]
+    assert conflicts == {"说": [TRUTH["说"], INCOMING[1]]}
+
+
+def test_concat_drops_repeated_definitions(tmp_path):
+    _, truth, _ = merge(tmp_path, "concat")
+    assert truth["书"]["english"] == "noun: book; volume; noun: letter"
+    assert truth["书"]["level"] == 2
+    assert truth["说"]["english"] == "verb: to speak; verb: to say"
+
+
+@pytest.mark.parametrize("policy", list(main.MERGE_POLICIES))
+def test_db_merge_matches_the_json_merge(tmp_path, policy):
+    counts, truth, conflicts = merge(tmp_path, policy)
+    db = str(tmp_path / "truth.db")
+    main.dump_json(TRUTH, str(tmp_path / "truth.json"))
+    main.store_import(str(tmp_path / "truth.json"), db)
+    db_counts = main.merge_batch(
+        [str(tmp_path / "incoming.json")],
+        policy,
+        conflicts_file=str(tmp_path / "db_conflicts.json"),
+        db=db,
+    )
+    main.store_export(db, str(tmp_path / "exported.json"))
+    assert db_counts == counts
+    assert read(tmp_path / "exported.json") == truth
+    assert read(tmp_path / "db_conflicts.json") == conflicts
+
+
+def test_consolidate_matches_a_lowest_level_merge(tmp_path):
+    user = tmp_path / "user"
+    user.mkdir()
+    main.dump_json(INCOMING[:2], str(user / "a.json"))
+    main.dump_json(
+        [
+            INCOMING[2],
+            INCOMING[3],
+            {"english": "verb: to read", "pinyin": "dú", "chinese": "读", "level": 1},
+            {"english": "verb: to write", "pinyin": "xiě", "chinese": "写", "level": 2},
+        ],
+        str(user / "b.json"),
+    )
+    truth = str(tmp_path / "truth.json")
+    main.dump_json(TRUTH, truth)
+    merged = main.merge_batch(
+        main.vocab_files([str(user)]),
+        "lowest-level",
+        truth=truth,
+        output=str(tmp_path / "merged.json"),
+        conflicts_file=str(tmp_path / "merge_conflicts.json"),
+    )
+    added, *consolidated = main.consolidate(
+        [str(user)],
+        truth=truth,
+        output=str(tmp_path / "consolidated.json"),
+        conflicts_file=str(tmp_path / "consolidate_conflicts.json"),
+        jobs=2,
+    )
+    assert (added, *consolidated) == (2, *merged)
+    assert merged == (2, 1)
+    # new cards go in level order rather than file order; the cards agree
+    assert read(tmp_path / "consolidated.json") == read(tmp_path / "merged.json")
+    assert list(read(tmp_path / "consolidated.json"))[2:] == ["读", "写"]
+    assert read(tmp_path / "consolidate_conflicts.json") == read(
+        tmp_path / "merge_conflicts.json"
+    )
@@ -0,0 +1,58 @@
+import os
+
+import main
+
+DEFINITIONS = ["v: to go", "n: book", "adj: good", "conj: and", "xyz: odd", "hello"]
+
+
+def deck(n):
+    return {
+        f"词{i}": {
+            "english": DEFINITIONS[i % len(DEFINITIONS)],
+            "pinyin": "cí",
+            "chinese": f"词{i}",
+            "level": i % 7,
+        }
+        for i in range(n)
+    }
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parallel_chunks_match_a_serial_run(tmp_path, monkeypatch):
+    main.dump_json(deck(60), str(tmp_path / "truth.json"))
+    serial = main.normalize(
+        [str(tmp_path / "truth.json")],
+        output=str(tmp_path / "serial.json"),
+        report=str(tmp_path / "serial-report.json"),
+        jobs=1,
+    )
+    monkeypatch.setattr(main, "CHUNK_CARDS", 7)
+    assert len(main._card_chunks(main.CardStore.from_json(deck(60)), 2)) > 1
+    parallel = main.normalize(
+        [str(tmp_path / "truth.json")],
+        output=str(tmp_path / "parallel.json"),
+        report=str(tmp_path / "parallel-report.json"),
+        jobs=2,
+    )
+    assert list(serial.values()) == list(parallel.values()) == [(60, 40, 20)]
+    assert read(tmp_path / "serial.json") == read(tmp_path / "parallel.json")
+    assert read(tmp_path / "serial-report.json") == read(
+        tmp_path / "parallel-report.json"
+    )
+
+
+def test_normalized_deck_is_left_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CHUNK_CARDS", 7)
+    path = str(tmp_path / "truth.json")
+    main.dump_json(deck(30), path)
+    main.normalize([path], jobs=2)
+    normalized = read(path)
+    stat = os.stat(path)
+
+    assert main.normalize([path], jobs=2) == {path: (30, 0, 10)}
+    assert read(path) == normalized
+    assert os.stat(path).st_mtime_ns == stat.st_mtime_ns
@@ -0,0 +1,48 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize(
+    ("numbered", "marked"),
+    [
+        ("ni3hao3", "nǐhǎo"),
+        ("ni3 hao3 ma5", "nǐ hǎo ma"),
+        ("fang4an4", "fàng'àn"),
+        ("lü4", "lǜ"),
+        ("hua4r", "huàr"),
+        ("na3r", "nǎr"),
+        ("Bei3jing1", "Běijīng"),
+        ("Xi1an1", "Xī'ān"),
+    ],
+)
+def test_round_trip(numbered, marked):
+    assert main.numbered_to_marked(numbered) == marked
+    assert main.marked_to_numbered(marked) == numbered
+
+
+@pytest.mark.parametrize(
+    ("numbered", "marked"),
+    [
+        ("lu:4", "lǜ"),
+        ("nv3", "nǚ"),
+        ("Lu:4", "Lǜ"),
+        ("nar3", "nǎr"),
+        ("Xi1'an1", "Xī'ān"),
+    ],
+)
+def test_alternative_spellings(numbered, marked):
+    assert main.numbered_to_marked(numbered) == marked
+
+
+def test_erhua_tone_digit_belongs_to_the_syllable_before():
+    assert main._segment_pinyin("nar3") == (("na", 3), ("r", 5))
+    assert main._segment_pinyin("hua4r") == (("hua", 4), ("r", 5))
+    assert main._segment_pinyin("hua4r4") is None
+    assert main.spaced_pinyin("yi1dianr3") == "yī diǎnr"
+
+
+def test_apostrophe_boundary():
+    assert main._segment_pinyin("fangan") == (("fan", 5), ("gan", 5))
+    assert main._segment_pinyin("fang4an4") == (("fang", 4), ("an", 4))
+    assert main._segment_pinyin("xian1") == (("xian", 1),)
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import main
+
+CARDS = {
+    "老师": {
+        "english": "noun: teacher",
+        "pinyin": "lǎoshī",
+        "chinese": "老师",
+        "level": 1,
+    },
+    "学生": {
+        "english": "noun: student",
+        "pinyin": "xuésheng",
+        "chinese": "学生",
+        "level": 1,
+    },
+    "老虎": {
+        "english": "noun: tiger",
+        "pinyin": "lǎohǔ",
+        "chinese": "老虎",
+        "level": 3,
+    },
+}
+
+
+@pytest.fixture
+def deck(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    main.dump_json(CARDS, "truth.json")
+    return tmp_path
+
+
+def found(query):
+    return [card["chinese"] for _, card in main.search(query)]
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("teacher", ["老师"]),
+        ("teach", ["老师"]),
+        ("lao3shi1", ["老师"]),
+        ("lǎoshī", ["老师"]),
+        ("laoshi", ["老师"]),
+        ("lao", ["老师", "老虎"]),
+        ("lao3", ["老师", "老虎"]),
+        ("老", ["老师", "老虎"]),
+        ("老虎", ["老虎"]),
+        ("lao tiger", ["老虎"]),
+        ("giraffe", []),
+    ],
+)
+def test_search_terms(deck, query, expected):
+    assert found(query) == expected
+
+
+def test_index_follows_truth_changes(deck):
+    assert main.update_search_index() == ["truth.json"]
+    assert main.update_search_index() == []
+    cards = dict(CARDS)
+    del cards["老虎"]
+    cards["猫"] = {"english": "noun: cat", "pinyin": "māo", "chinese": "猫", "level": 2}
+    main.dump_json(cards, "truth.json")
+    stat = os.stat("truth.json")
+    os.utime("truth.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert found("cat") == ["猫"]
+    assert found("tiger") == []
+    assert found("老") == ["老师"]
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+
+def test_flush_and_export_write_a_copy_of_the_deck(tmp_path):
+    deck = tmp_path / "truth.json"
+    main.dump_json({}, str(deck))
+    server = main.VocabServer(str(deck), flush_delay=60)
+    card = {"english": "teacher", "pinyin": "lǎoshī", "chinese": "老师", "level": 1}
+
+    async def session():
+        assert await server.handle({"op": "add", "card": card}) == "added"
+        flushed = asyncio.wrap_future(server.flush())
+        await server.handle({"op": "add", "card": dict(card, chinese="学生")})
+        assert await flushed
+        out = str(tmp_path / "out.tsv")
+        return await server.handle({"op": "export", "file": out})
+
+    try:
+        assert asyncio.run(session()) == 2
+    finally:
+        server._writer.shutdown()
+    with open(deck, encoding="utf-8") as f:
+        assert list(json.load(f)) == ["老师"]
+    assert server.pending == 1
+
+
+def test_failed_flush_keeps_changes_pending_and_retries(tmp_path, monkeypatch, capsys):
+    deck = tmp_path / "truth.json"
+    main.dump_json({}, str(deck))
+    server = main.VocabServer(str(deck), flush_delay=0.01)
+    card = {"english": "teacher", "pinyin": "lǎoshī", "chinese": "老师", "level": 1}
+    dump_json = main.dump_json
+
+    def fail_once(data, file):
+        monkeypatch.setattr(main, "dump_json", dump_json)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(main, "dump_json", fail_once)
+
+    async def session():
+        await server.handle({"op": "add", "card": card})
+        reply = await server.handle({"op": "stats"})
+        await asyncio.sleep(0.2)
+        return reply
+
+    try:
+        assert asyncio.run(session()) == {"cards": 1, "pending": 1}
+    finally:
+        server._writer.shutdown()
+    assert "disk full" in capsys.readouterr().err
+    with open(deck, encoding="utf-8") as f:
+        assert list(json.load(f)) == ["老师"]
+    assert server.pending == 0
+
+
+def test_add_rejects_non_string_text_fields(tmp_path):
+    server = main.VocabServer(str(tmp_path / "truth.json"))
+    card = {"english": ["teacher"], "pinyin": "lǎoshī", "chinese": "老师"}
+    try:
+        with pytest.raises(ValueError, match="english"):
+            asyncio.run(server.handle({"op": "add", "card": card}))
+        with pytest.raises(ValueError, match="pinyin"):
+            asyncio.run(
+                server.handle(
+                    {"op": "add", "card": {**card, "english": "", "pinyin": 3}}
+                )
+            )
+    finally:
+        server._writer.shutdown()
+    assert len(server.cards) == 0
+    assert server.pending == 0
@@ -0,0 +1,29 @@
+import main
+
+
+def test_torn_review_log_line_is_dropped(tmp_path):
+    log = str(tmp_path / "truth.reviews.jsonl")
+    main.record_review(log, "你", 5, 1000)
+    with open(log, "a", encoding="utf-8") as f:
+        f.write('{"chinese": "好", "gra')
+
+    states = main.load_schedule(log)
+    assert list(states) == ["你"]
+
+    main.record_review(log, "好", 4, 2000)
+    states = main.load_schedule(log)
+    assert states["好"] == main.sm2(None, 4, 2000)
+
+
+def test_schedule_snapshot_replays_only_the_tail(tmp_path):
+    log = str(tmp_path / "truth.reviews.jsonl")
+    for i in range(5):
+        main.record_review(log, "你", 5, 1000 + i)
+    before = main.load_schedule(log)
+
+    main.record_review(log, "你", 0, 2000)
+    states = main.load_schedule(log)
+    assert states["你"] == main.sm2(before["你"], 0, 2000)
+
+    (tmp_path / "truth.reviews.schedule.json").unlink()
+    assert main.load_schedule(log) == states